@@ -0,0 +1,166 @@
+# Shared, cached index of a dataset folder, used by the dataset scripts instead of os.listdir/os.walk/os.path.exists calls.
+# Per directory it keeps its mtime, its subfolders and its file names, listed with os.scandir and no per-file stat.
+# It is saved in ~/.cache/ml_py_tools (or $DATASET_INDEX_DIR) and checked lazily: a directory is stat'ed once per run when it is first asked for,
+# listed again only when its mtime changed, and subfolders are only visited by recursive queries.
+# python3 dataset_index.py folder   builds or refreshes the index and prints a summary
+
+import os
+import sys
+import json
+import time
+import hashlib
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+LABEL_EXTENSIONS = ('.txt',)
+CACHE_DIR = os.environ.get("DATASET_INDEX_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "ml_py_tools")
+RECENT_NS = 2_000_000_000  # directories modified this recently are listed again next time, their mtime may not have settled
+
+INDEX_VERSION = 2
+
+class DatasetIndex:
+    """Files of one directory tree. dirs maps a folder path relative to root ("" for root) to [mtime_ns, subfolder names, file names]."""
+
+    def __init__(self, root, dirs=None):
+        self.root = os.path.abspath(root)
+        self.dirs = dirs or {}
+        self.checked = set()  # folders whose mtime was compared during this run
+        self.rescanned = 0
+        self._names = {}  # folder -> set of file names, for exists()
+
+    @property
+    def cache_path(self):
+        return os.path.join(CACHE_DIR, hashlib.sha1(self.root.encode()).hexdigest()[:16] + ".json")
+
+    def _entry(self, rel):
+        """Entry of folder rel, compared with the folder's mtime the first time it is asked for and listed again when it changed. None when it does not exist."""
+        if rel not in self.checked:
+            self.checked.add(rel)
+            path = os.path.join(self.root, rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self.dirs.pop(rel, None)  # removed since the last run
+                return None
+            entry = self.dirs.get(rel)
+            if entry is None or entry[0] != mtime:
+                self.dirs[rel] = self._scan(path, mtime)
+                self._names.pop(rel, None)
+                self.rescanned += 1
+        return self.dirs.get(rel)
+
+    def refresh(self, folder="", recursive=True):
+        """Checks folder, and all its subfolders when recursive. Returns how many folders were listed again."""
+        before = self.rescanned
+        for _ in self._folders(folder, recursive):
+            pass
+        return self.rescanned - before
+
+    @staticmethod
+    def _scan(path, mtime):
+        subfolders = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # is_dir/is_symlink come from the directory listing itself, no stat per entry
+                if entry.is_dir():
+                    if not entry.is_symlink():  # like os.walk, directory links are not followed
+                        subfolders.append(entry.name)
+                    continue
+                if entry.is_symlink() and not os.path.exists(entry.path):
+                    continue  # broken link
+                files.append(entry.name)
+        if time.time_ns() - mtime < RECENT_NS:
+            mtime = None
+        return [mtime, subfolders, files]
+
+    def save(self):
+        # Only folders still reachable from the root are kept, removed subtrees drop out of the cache
+        reachable = {}
+        pending = [""]
+        while pending:
+            rel = pending.pop()
+            if rel in self.dirs:
+                reachable[rel] = self.dirs[rel]
+                pending.extend(os.path.join(rel, subfolder) for subfolder in self.dirs[rel][1])
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "root": self.root, "dirs": reachable}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.cache_path)
+
+    def _folders(self, folder="", recursive=True):
+        """Relative folders in os.walk order, starting at folder."""
+        entry = self._entry(folder)
+        if entry is None:
+            return
+        yield folder
+        if recursive:
+            for subfolder in entry[1]:
+                yield from self._folders(os.path.join(folder, subfolder), True)
+
+    def paths(self, extensions=None, folder="", recursive=True):
+        """Paths of the files under folder ending with one of extensions (case-insensitive), in os.walk order."""
+        found = []
+        for rel in self._folders(folder, recursive):
+            base = os.path.join(self.root, rel)
+            for name in self.dirs[rel][2]:
+                if extensions is None or name.lower().endswith(extensions):
+                    found.append(os.path.join(base, name))
+        return found
+
+    def by_stem(self, extensions=None, folder="", recursive=True):
+        """{file stem: path}, the first file found wins when stems repeat."""
+        stems = {}
+        for path in self.paths(extensions, folder, recursive):
+            stems.setdefault(os.path.splitext(os.path.basename(path))[0], path)
+        return stems
+
+    def images(self, folder="", recursive=True):
+        return self.by_stem(IMAGE_EXTENSIONS, folder, recursive)
+
+    def labels(self, folder="", recursive=True):
+        return self.by_stem(LABEL_EXTENSIONS, folder, recursive)
+
+    def subfolders(self, folder=""):
+        entry = self._entry(folder)
+        return list(entry[1]) if entry else []
+
+    def exists(self, path):
+        rel_folder, name = os.path.split(os.path.relpath(os.path.abspath(path), self.root))
+        if rel_folder.split(os.sep)[0] == os.pardir:
+            return False  # outside the root
+        entry = self._entry(rel_folder)
+        if not entry:
+            return False
+        if rel_folder not in self._names:
+            self._names[rel_folder] = set(entry[2])
+        return name in self._names[rel_folder]
+
+def load_index(root, persist=True, recursive=True):
+    """Index of root, loaded from the cache and checked down to the depth asked for: root only, or the whole tree when recursive.
+    Saved back when persist is set and something changed. FileNotFoundError when root is not a directory."""
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"No such directory: {root}")
+    index = DatasetIndex(root)
+    try:
+        with open(index.cache_path) as f:
+            data = json.load(f)
+        if data.get("version") == INDEX_VERSION and data.get("root") == index.root:
+            index.dirs = data["dirs"]
+    except (OSError, ValueError, KeyError):
+        pass
+    if index.refresh(recursive=recursive) and persist:
+        try:
+            index.save()
+        except OSError:
+            pass  # read-only home, the index still works for this run
+    return index
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python dataset_index.py <folder>")
+        sys.exit(1)
+    started = time.perf_counter()
+    index = load_index(sys.argv[1])
+    print(f"{len(index.dirs)} folders, {len(index.paths(IMAGE_EXTENSIONS))} images, {len(index.paths(LABEL_EXTENSIONS))} labels, {time.perf_counter() - started:.2f}s")
+    print(f"Index: {index.cache_path}")
@@ -1,19 +1,36 @@
-#pip install pycocotools requests tqdm
+#pip install numpy requests tqdm (aiohttp for --async)
 # multi-threaded interactive script to download specific class(es) from the coco dataset
 # script first downloads annotations to then query user's choice(s)
-# can also run like so "python3 download_coco_categories.py 0,1,2 download_path(optional, default: current directory)"
+# can also run like so "python3 download_coco_categories.py 0,1,2 download_path(optional, default: current directory) workers(optional, default: 16)"
+# --async anywhere on the command line switches to the asyncio engine (workers then means concurrent connections, default: 64)
+# python3 download_coco_categories.py --benchmark compares both engines against a local mock server
+# images already downloaded are skipped, so an interrupted run can simply be restarted
+# the annotation JSON is parsed once into a compact memory-mapped index (annotations/index_train2017), later runs start in milliseconds
 import os
 import sys
+import json
 import requests
-from pycocotools.coco import COCO
+import numpy as np
 from tqdm import tqdm
 import concurrent.futures
 import threading
 import time
+import asyncio
+import tempfile
+import http.server
+try:
+    import aiohttp  # only needed by the asyncio engine
+except ImportError:
+    aiohttp = None
 
 # Constants
 BASE_URL = 'http://images.cocodataset.org/'
 ANN_FILE = 'http://images.cocodataset.org/annotations/annotations_trainval2017.zip'
+DEFAULT_WORKERS = 16
+CHUNK_SIZE = 64 * 1024
+LABEL_WRITERS = 4
+DEFAULT_CONNECTIONS = 64  # asyncio engine
+DISK_WORKERS = 4  # asyncio engine, threads doing the file writes
 lock = threading.Lock()
 
 def download_file(url, dest):
@@ -49,41 +66,263 @@ def download_annotations(data_dir):
     else:
         print("Annotations already present.")
 
+class CocoIndex:
+    """Columnar, memory-mapped replacement for the parts of pycocotools.COCO this script uses.
+    Built once from the annotation JSON: image columns, annotation columns sorted by image id, and per-category image id arrays."""
+
+    def __init__(self, index_dir):
+        load = lambda name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+        with open(os.path.join(index_dir, "categories.json")) as f:
+            self.category_names = {int(cat_id): name for cat_id, name in json.load(f).items()}
+        self.image_ids = load("image_ids")  # sorted
+        self.image_files = load("image_files")
+        self.image_sizes = load("image_sizes")  # (width, height)
+        self.ann_image_ids = load("ann_image_ids")  # sorted, annotations of an image are contiguous
+        self.ann_category_ids = load("ann_category_ids")
+        self.ann_bboxes = load("ann_bboxes")
+        self.cat_ids = load("cat_ids")
+        self.cat_offsets = load("cat_offsets")
+        self.cat_image_ids = load("cat_image_ids")
+
+    @staticmethod
+    def build(ann_file, index_dir):
+        """One-time conversion of a COCO instances JSON into the index folder."""
+        with open(ann_file) as f:
+            data = json.load(f)
+        os.makedirs(index_dir, exist_ok=True)
+        save = lambda name, array: np.save(os.path.join(index_dir, f"{name}.npy"), array)
+
+        images = sorted(data['images'], key=lambda img: img['id'])
+        save("image_ids", np.array([img['id'] for img in images], dtype=np.int64))
+        save("image_files", np.array([img['file_name'].encode() for img in images], dtype=np.bytes_))
+        save("image_sizes", np.array([(img['width'], img['height']) for img in images], dtype=np.int32).reshape(-1, 2))
+
+        annotations = data['annotations']
+        ann_image_ids = np.array([ann['image_id'] for ann in annotations], dtype=np.int64)
+        ann_category_ids = np.array([ann['category_id'] for ann in annotations], dtype=np.int32)
+        order = np.argsort(ann_image_ids, kind="stable")
+        save("ann_image_ids", ann_image_ids[order])
+        save("ann_category_ids", ann_category_ids[order])
+        save("ann_bboxes", np.array([ann['bbox'] for ann in annotations], dtype=np.float64).reshape(-1, 4)[order])
+
+        # Per category: the sorted unique ids of the images it appears in, stored back to back with offsets
+        cat_ids = np.array(sorted(category['id'] for category in data['categories']), dtype=np.int32)
+        per_category = [np.unique(ann_image_ids[ann_category_ids == cat_id]) for cat_id in cat_ids]
+        save("cat_ids", cat_ids)
+        save("cat_offsets", np.cumsum([0] + [len(ids) for ids in per_category]).astype(np.int64))
+        save("cat_image_ids", np.concatenate(per_category) if per_category else np.zeros(0, dtype=np.int64))
+
+        with open(os.path.join(index_dir, "categories.json"), "w") as f:
+            json.dump({category['id']: category['name'] for category in sorted(data['categories'], key=lambda c: c['id'])}, f)
+
+    @classmethod
+    def open(cls, data_dir, split='train2017'):
+        """Index of data_dir's annotations, built on first use."""
+        index_dir = os.path.join(data_dir, 'annotations', f'index_{split}')
+        if not os.path.exists(os.path.join(index_dir, "categories.json")):  # written last, a partial index is rebuilt
+            print("Building the annotation index, one time only...")
+            cls.build(os.path.join(data_dir, 'annotations', f'instances_{split}.json'), index_dir)
+        return cls(index_dir)
+
+    def category_image_ids(self, cat_id):
+        i = int(np.searchsorted(self.cat_ids, cat_id))
+        if i == len(self.cat_ids) or self.cat_ids[i] != cat_id:
+            raise KeyError(f"unknown category id {cat_id}")
+        return self.cat_image_ids[self.cat_offsets[i]:self.cat_offsets[i + 1]]
+
+    def get_img_ids(self, cat_ids):
+        """Ids of the images containing every category of cat_ids, like COCO.getImgIds(catIds=...)."""
+        ids = None
+        for cat_id in cat_ids:
+            cat_images = self.category_image_ids(cat_id)
+            ids = cat_images if ids is None else np.intersect1d(ids, cat_images, assume_unique=True)
+        return [] if ids is None else ids.tolist()
+
+    def load_imgs(self, img_ids):
+        rows = np.searchsorted(self.image_ids, img_ids)
+        return [
+            {'id': int(self.image_ids[row]), 'file_name': self.image_files[row].decode(), 'width': int(self.image_sizes[row, 0]), 'height': int(self.image_sizes[row, 1])}
+            for row in rows
+        ]
+
 def list_categories(coco):
-    categories = coco.loadCats(coco.getCatIds())
-    category_names = {category['id']: category['name'] for category in categories}
-    return category_names
+    return dict(coco.category_names)
+
+def make_session(workers=DEFAULT_WORKERS):
+    """Session with a keep-alive connection pool sized for the number of download threads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def download_image(img, images_dir, session=None, base_url=BASE_URL, retries=4, backoff=0.5, timeout=30):
+    """Streams one image to a temporary file renamed into place once complete, so any file present is whole.
+    Files already there (non-empty) are skipped. Retries with exponential backoff. Returns True if downloaded, False if skipped."""
+    img_url = base_url + 'train2017/' + img['file_name']
+    img_file = os.path.join(images_dir, img['file_name'])
+    try:
+        if os.path.getsize(img_file) > 0:
+            return False
+    except OSError:
+        pass
+
+    session = session or requests
+    tmp_file = img_file + '.part'
+    for attempt in range(retries + 1):
+        try:
+            with session.get(img_url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                expected = int(response.headers.get('content-length', 0))
+                written = 0
+                with open(tmp_file, 'wb') as handler:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        handler.write(chunk)
+                        written += len(chunk)
+            if expected and written != expected:
+                raise IOError(f"incomplete download, {written} of {expected} bytes")
+            os.replace(tmp_file, img_file)
+            return True
+        except (requests.RequestException, IOError) as exc:
+            if isinstance(exc, requests.HTTPError) and exc.response is not None and exc.response.status_code < 500:
+                raise  # 404 and co. will not get better
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def build_labels(coco, imgs, category_ids):
+    """YOLO label text of every image in imgs, in one NumPy pass over all their annotations, lines in annotation order, classes numbered in category_ids order."""
+    img_ids = np.array([img['id'] for img in imgs], dtype=np.int64)
+    starts = np.searchsorted(coco.ann_image_ids, img_ids)
+    counts = np.searchsorted(coco.ann_image_ids, img_ids + 1) - starts
+    owners = np.repeat(np.arange(len(imgs)), counts)
+    rows = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+    # Class remap through a lookup array, -1 for the categories that were not selected
+    classes = np.full(int(coco.cat_ids[-1]) + 1 if len(coco.cat_ids) else 1, -1, dtype=np.int64)
+    classes[np.asarray(category_ids, dtype=np.int64)] = np.arange(len(category_ids))
+    classes = classes[coco.ann_category_ids[rows]]
+    keep = classes >= 0
+    owners, rows, classes = owners[keep], rows[keep], classes[keep]
+
+    sizes = np.array([(img['width'], img['height']) for img in imgs], dtype=np.float64).reshape(-1, 2)[owners]
+    bboxes = np.asarray(coco.ann_bboxes[rows], dtype=np.float64).reshape(-1, 4)
+    boxes = np.stack([
+        (bboxes[:, 0] + bboxes[:, 2] / 2) / sizes[:, 0],
+        (bboxes[:, 1] + bboxes[:, 3] / 2) / sizes[:, 1],
+        bboxes[:, 2] / sizes[:, 0],
+        bboxes[:, 3] / sizes[:, 1],
+    ], axis=1)
+
+    lines = [[] for _ in imgs]
+    for owner, cls, (x_center, y_center, width, height) in zip(owners.tolist(), classes.tolist(), boxes.tolist()):
+        lines[owner].append(f"{cls} {x_center} {y_center} {width} {height}\n")
+    return {img['id']: "".join(img_lines) for img, img_lines in zip(imgs, lines)}
+
+def write_label_file(img, text, labels_dir):
+    with open(os.path.join(labels_dir, f"{os.path.splitext(img['file_name'])[0]}.txt"), 'w') as lf:
+        lf.write(text)
+
+def download_with_threads(imgs, images_dir, labels, labels_dir, workers=DEFAULT_WORKERS, base_url=BASE_URL):
+    """Thread pool engine, one pooled requests session shared by the download threads."""
+    session = make_session(workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=LABEL_WRITERS) as label_writer:
+        future_to_img = {executor.submit(download_image, img, images_dir, session, base_url): img for img in imgs}
+
+        label_futures = {}
+        for future in tqdm(concurrent.futures.as_completed(future_to_img), total=len(imgs), desc="Downloading images and creating labels", unit="image"):
+            img = future_to_img[future]
+            try:
+                future.result()
+                if labels is not None:
+                    label_futures[label_writer.submit(write_label_file, img, labels[img['id']], labels_dir)] = img
+            except Exception as exc:
+                print(f"Error downloading {img['file_name']}: {exc}")
+
+        for future in concurrent.futures.as_completed(label_futures):
+            try:
+                future.result()
+            except Exception as exc:
+                print(f"Error writing the label of {label_futures[future]['file_name']}: {exc}")
 
-def download_image(img, images_dir):
-    img_url = BASE_URL + 'train2017/' + img['file_name']
-    img_data = requests.get(img_url).content
+async def download_image_async(img, images_dir, client, disk, base_url=BASE_URL, retries=4, backoff=0.5):
+    """download_image for the asyncio engine: the body is streamed from the event loop, file writes go to the disk thread pool."""
+    img_url = base_url + 'train2017/' + img['file_name']
     img_file = os.path.join(images_dir, img['file_name'])
+    try:
+        if os.path.getsize(img_file) > 0:
+            return False
+    except OSError:
+        pass
+
+    loop = asyncio.get_running_loop()
+    tmp_file = img_file + '.part'
+    for attempt in range(retries + 1):
+        try:
+            async with client.get(img_url) as response:
+                response.raise_for_status()
+                expected = response.content_length or 0
+                written = 0
+                handler = await loop.run_in_executor(disk, open, tmp_file, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await loop.run_in_executor(disk, handler.write, chunk)
+                        written += len(chunk)
+                finally:
+                    await loop.run_in_executor(disk, handler.close)
+            if expected and written != expected:
+                raise IOError(f"incomplete download, {written} of {expected} bytes")
+            await loop.run_in_executor(disk, os.replace, tmp_file, img_file)
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as exc:
+            if isinstance(exc, aiohttp.ClientResponseError) and exc.status < 500:
+                raise  # 404 and co. will not get better
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+async def _download_all_async(imgs, images_dir, labels, labels_dir, connections, base_url):
+    semaphore = asyncio.Semaphore(connections)
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DISK_WORKERS) as disk, \
+            tqdm(total=len(imgs), desc="Downloading images and creating labels", unit="image") as bar:
+        connector = aiohttp.TCPConnector(limit=connections)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_read=30)) as client:
+
+            async def fetch(img):
+                try:
+                    async with semaphore:
+                        await download_image_async(img, images_dir, client, disk, base_url)
+                except Exception as exc:
+                    print(f"Error downloading {img['file_name']}: {exc}")
+                else:
+                    if labels is not None:  # the connection slot is free again while the label is written
+                        try:
+                            await loop.run_in_executor(disk, write_label_file, img, labels[img['id']], labels_dir)
+                        except Exception as exc:
+                            print(f"Error writing the label of {img['file_name']}: {exc}")
+                bar.update(1)
+
+            await asyncio.gather(*(fetch(img) for img in imgs))
 
-    with open(img_file, 'wb') as handler:
-        handler.write(img_data)
-
-def create_label_file(img, anns, labels_dir, category_ids):
-    label_file = os.path.join(labels_dir, f"{os.path.splitext(img['file_name'])[0]}.txt")
-    with open(label_file, 'w') as lf:
-        for ann in anns:
-            category_id = ann['category_id']
-            if category_id in category_ids:
-                bbox = ann['bbox']
-                x_center = (bbox[0] + bbox[2] / 2) / img['width']
-                y_center = (bbox[1] + bbox[3] / 2) / img['height']
-                width = bbox[2] / img['width']
-                height = bbox[3] / img['height']
-                lf.write(f"{category_ids.index(category_id)} {x_center} {y_center} {width} {height}\n")
-
-def download_images_and_create_labels(data_dir, category_ids, category_names, limit=None):
-    # Initialize COCO api
-    coco = COCO(os.path.join(data_dir, 'annotations', 'instances_train2017.json'))
+def download_with_asyncio(imgs, images_dir, labels, labels_dir, workers=DEFAULT_CONNECTIONS, base_url=BASE_URL):
+    """asyncio engine: up to workers concurrent connections on one event loop, no thread per request."""
+    if aiohttp is None:
+        raise RuntimeError("the asyncio engine needs aiohttp: pip install aiohttp")
+    asyncio.run(_download_all_async(imgs, images_dir, labels, labels_dir, workers, base_url))
+
+ENGINES = {'threads': download_with_threads, 'asyncio': download_with_asyncio}
+
+def download_images_and_create_labels(data_dir, category_ids, category_names, limit=None, workers=None, base_url=BASE_URL, engine='threads'):
+    # Memory-mapped annotation index
+    coco = CocoIndex.open(data_dir)
 
     # Get category IDs for selected categories
-    imgIds = coco.getImgIds(catIds=category_ids)
+    imgIds = coco.get_img_ids(category_ids)
     if limit:
         imgIds = imgIds[:limit]
-    imgs = coco.loadImgs(imgIds)
+    imgs = coco.load_imgs(imgIds)
 
     images_dir = os.path.join(data_dir, 'images')
     labels_dir = os.path.join(data_dir, 'labels')
@@ -91,21 +330,58 @@ def download_images_and_create_labels(data_dir, category_ids, category_names, li
     os.makedirs(images_dir, exist_ok=True)
     os.makedirs(labels_dir, exist_ok=True)
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_img = {executor.submit(download_image, img, images_dir): img for img in imgs}
+    # All labels up front, written off the download path once the image is there
+    labels = build_labels(coco, imgs, category_ids)
 
-        for future in tqdm(concurrent.futures.as_completed(future_to_img), total=len(imgs), desc="Downloading images and creating labels", unit="image"):
-            img = future_to_img[future]
-            try:
-                future.result()
-                # Create label file
-                annIds = coco.getAnnIds(imgIds=img['id'], catIds=category_ids, iscrowd=None)
-                anns = coco.loadAnns(annIds)
-                create_label_file(img, anns, labels_dir, category_ids)
-            except Exception as exc:
-                print(f"Error downloading {img['file_name']}: {exc}")
+    if workers is None:
+        workers = DEFAULT_CONNECTIONS if engine == 'asyncio' else DEFAULT_WORKERS
+    ENGINES[engine](imgs, images_dir, labels, labels_dir, workers, base_url)
+
+class _MockImageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+    payload = b""
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+def benchmark(count=2000, size=150_000, latency=0.05, thread_workers=DEFAULT_WORKERS, connections=DEFAULT_CONNECTIONS):
+    """Times both engines against a local mock server answering every image after latency seconds."""
+    _MockImageHandler.payload = os.urandom(size)
+    _MockImageHandler.latency = latency
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _MockImageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    imgs = [{'id': i, 'file_name': f"{i:012d}.jpg"} for i in range(count)]
+    try:
+        for engine, workers in (('threads', thread_workers), ('asyncio', connections)):
+            if engine == 'asyncio' and aiohttp is None:
+                print("asyncio: skipped, pip install aiohttp")
+                continue
+            with tempfile.TemporaryDirectory() as images_dir:
+                started = time.perf_counter()
+                ENGINES[engine](imgs, images_dir, None, None, workers, base_url)
+                elapsed = time.perf_counter() - started
+            print(f"{engine:>8} x{workers}: {elapsed:.2f}s, {count / elapsed:.0f} images/s, {count * size / elapsed / 1e6:.1f} MB/s")
+    finally:
+        server.shutdown()
 
 if __name__ == '__main__':
+    if sys.argv[1:] == ["--benchmark"]:
+        benchmark()
+        sys.exit(0)
+    engine = 'threads'
+    if '--async' in sys.argv:
+        sys.argv.remove('--async')
+        engine = 'asyncio'
     if len(sys.argv) < 3:
         print("Usage: python script.py \"class_numbers(comma separated)\" \"download_path(optional, default: current directory)\"")
         class_numbers = input("Enter the category numbers you want to download, separated by commas: ")
@@ -115,12 +391,13 @@ if __name__ == '__main__':
     else:
         class_numbers = sys.argv[1]
         data_dir = sys.argv[2]
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
 
     # Download annotations
     download_annotations(data_dir)
 
-    # Initialize COCO api to list categories
-    coco = COCO(os.path.join(data_dir, 'annotations', 'instances_train2017.json'))
+    # Memory-mapped annotation index to list categories, built on the first run
+    coco = CocoIndex.open(data_dir)
     category_names = list_categories(coco)
 
     category_indexes = [int(idx.strip()) for idx in class_numbers.split(',') if idx.strip().isdigit()]
@@ -133,4 +410,4 @@ if __name__ == '__main__':
 
     print(f"Downloading images and labels for categories: {', '.join([category_names[cat_id] for cat_id in selected_category_ids])}")
     # Download images for selected categories and create labels
-    download_images_and_create_labels(data_dir, selected_category_ids, [category_names[cat_id] for cat_id in selected_category_ids])
+    download_images_and_create_labels(data_dir, selected_category_ids, [category_names[cat_id] for cat_id in selected_category_ids], workers=workers, engine=engine)
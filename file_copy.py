@@ -0,0 +1,24 @@
+# Shared file copy used by the dataset scripts, kept free of heavy imports so any script can use it.
+# os.copy_file_range lets the kernel copy without going through Python, large buffers otherwise.
+import os
+import shutil
+
+COPY_BUFFER = 16 * 1024 * 1024
+
+def copy_file(source_file, destination_file):
+    """Copies the content and the metadata of source_file to destination_file."""
+    with open(source_file, 'rb') as fsrc, open(destination_file, 'wb') as fdst:
+        copied = False
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_BUFFER):
+                    pass
+                copied = True
+            except OSError:
+                # Not supported between these filesystems, start over with a plain copy
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        if not copied:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER)
+    shutil.copystat(source_file, destination_file)
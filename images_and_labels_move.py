@@ -1,33 +1,232 @@
 #move a percentage of images and their corresponding annotations
+#--mode hardlink/symlink builds the split with links instead, no data is copied or moved
+#--stratified keeps rare classes in val, --seed makes the split reproducible, --manifest/--apply save and replay it
 import os
-import shutil
+import json
 import random
 import argparse
+import numpy as np
 from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataset_index import load_index
+from file_copy import copy_file
 
-def move_files(file_list, source_folder, destination_folder):
-    """Move selected files from source folder to destination folder."""
+MODES = ("move", "hardlink", "symlink")
+MAX_CLASS_ID = 4095  # above every public detection label set, larger ids are taken for corrupt labels: the count matrix has one column per id
+
+def transfer_batch(moves, same_device, mode):
+    for source_file, destination_file in moves:
+        if mode == "symlink":
+            os.symlink(os.path.abspath(source_file), destination_file)
+        elif mode == "hardlink":
+            os.link(source_file, destination_file)
+        elif same_device:
+            os.rename(source_file, destination_file)
+        else:
+            copy_file(source_file, destination_file)
+            os.remove(source_file)
+
+def transfer_files(moves, mode="move", max_workers=None, batch_size=256):
+    """Moves or links (source, destination) pairs. Work is grouped by source and destination device:
+    same device is a plain rename, cross-device is a copy and delete. Batches run in a thread pool."""
+    devices = {}
+    def device(folder):
+        if folder not in devices:
+            devices[folder] = os.stat(folder).st_dev
+        return devices[folder]
+
+    groups = defaultdict(list)
+    for source_file, destination_file in moves:
+        groups[(device(os.path.dirname(source_file) or "."), device(os.path.dirname(destination_file) or "."))].append((source_file, destination_file))
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+        futures = []
+        for (source_device, destination_device), group in groups.items():
+            group_mode = mode
+            if mode == "hardlink" and source_device != destination_device:
+                print(f"Hard links cannot cross devices, using symlinks for {len(group)} files.")
+                group_mode = "symlink"
+            for i in range(0, len(group), batch_size):
+                futures.append(executor.submit(transfer_batch, group[i:i + batch_size], source_device == destination_device, group_mode))
+        for future in futures:
+            future.result()
+
+def move_files(file_list, source_folder, destination_folder, mode="move"):
+    """Move (or link) selected files from source folder to destination folder."""
     os.makedirs(destination_folder, exist_ok=True)
-    for file_name in file_list:
-        source_file = os.path.join(source_folder, file_name)
-        destination_file = os.path.join(destination_folder, file_name)
-        shutil.move(source_file, destination_file)
-
-def select_and_move_files(images_folder, labels_folder, val_images_folder, val_labels_folder, val_percentage):
-    """Select 5% of files and move them to validation folders."""
-    images = [f for f in os.listdir(images_folder) if f.endswith(('.jpg', '.png', '.jpeg', '.webp'))]
-    
-    num_val_images = max(1, int(len(images) * val_percentage))
-    val_images = random.sample(images, num_val_images)
-    
+    transfer_files([(os.path.join(source_folder, file_name), os.path.join(destination_folder, file_name)) for file_name in file_list], mode)
+
+def read_label_classes(label_files):
+    """Class ids found in each YOLO label file, one list per file, and (label file, line number, error) of each malformed line.
+    A class id must be a whole number from 0 to MAX_CLASS_ID. Runs in worker processes."""
+    classes = []
+    malformed = []
+    for label_file in label_files:
+        file_classes = []
+        if label_file:
+            try:
+                with open(label_file) as f:
+                    for line_number, line in enumerate(f, 1):
+                        parts = line.split()
+                        if not parts:
+                            continue
+                        try:
+                            value = float(parts[0])
+                        except ValueError:
+                            malformed.append((label_file, line_number, f"class id {parts[0]!r} is not a number"))
+                            continue
+                        if not value.is_integer() or not 0 <= value <= MAX_CLASS_ID:
+                            malformed.append((label_file, line_number, f"class id {parts[0]} is not a whole number from 0 to {MAX_CLASS_ID}"))
+                            continue
+                        file_classes.append(int(value))
+            except OSError:
+                pass
+        classes.append(file_classes)
+    return classes, malformed
+
+def class_count_matrix(label_files, chunk_size=2048):
+    """(images, classes) uint16 matrix of box counts per class, label files parsed in parallel. None in label_files is an image without label."""
+    chunks = [label_files[i:i + chunk_size] for i in range(0, len(label_files), chunk_size)]
+    per_file = []
+    with ProcessPoolExecutor() as executor:
+        for classes, malformed in executor.map(read_label_classes, chunks):
+            per_file.extend(classes)
+            for label_file, line_number, error in malformed:
+                print(f"Malformed label {label_file}, line {line_number}: {error}, line ignored")
+
+    num_classes = max((max(classes) for classes in per_file if classes), default=-1) + 1
+    rows = np.repeat(np.arange(len(per_file)), [len(classes) for classes in per_file])
+    cols = np.fromiter((c for classes in per_file for c in classes), dtype=np.int64, count=len(rows))
+    counts = np.zeros((len(per_file), num_classes), dtype=np.uint16)
+    np.add.at(counts, (rows, cols), 1)
+    return counts
+
+def stratified_split(counts, val_fraction, seed=None, block=65536):
+    """Indices of a class-stratified validation subset, reproducible for a given seed.
+    Each class aims at val_fraction of the images that contain it (at least one when it appears in two images or more).
+    Images are handled through their rarest class, rarest classes first, so an image with several classes counts for all of them.
+    Remaining budget is filled at random."""
+    num_images, num_classes = counts.shape
+    num_val = max(1, int(num_images * val_fraction))
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(num_images)
+
+    class_totals = (counts > 0).sum(axis=0)
+    desired = np.round(class_totals * val_fraction).astype(np.int64)
+    desired[(class_totals >= 2) & (desired == 0)] = 1
+
+    # Rarest class of each image, -1 for images without boxes. In blocks, to keep temporaries small.
+    rarest = np.full(num_images, -1, dtype=np.int64)
+    for start in range(0, num_images, block):
+        present = counts[start:start + block] > 0
+        if num_classes:
+            masked = np.where(present, class_totals, np.iinfo(np.int64).max)
+            rarest[start:start + block] = np.where(present.any(axis=1), masked.argmin(axis=1), -1)
+
+    # Shuffled images grouped by rarest class
+    keys = rarest[order]
+    grouped = order[np.argsort(keys, kind="stable")]
+    bounds = np.searchsorted(np.sort(keys), np.arange(-1, num_classes + 1))
+
+    selected = np.zeros(num_images, dtype=bool)
+    val_counts = np.zeros(num_classes, dtype=np.int64)
+    taken = 0
+
+    def take(image):
+        nonlocal taken
+        selected[image] = True
+        val_counts[counts[image] > 0] += 1
+        taken += 1
+
+    for c in np.argsort(class_totals, kind="stable"):
+        for image in grouped[bounds[c + 1]:bounds[c + 2]]:
+            if val_counts[c] >= desired[c] or taken >= num_val:
+                break
+            take(image)
+
+    # Classes still short took their images from rarer groups, look at every image containing them
+    for c in np.argsort(class_totals, kind="stable"):
+        if val_counts[c] >= desired[c] or taken >= num_val:
+            continue
+        for image in order[counts[order, c] > 0]:
+            if val_counts[c] >= desired[c] or taken >= num_val:
+                break
+            if not selected[image]:
+                take(image)
+
+    for image in order:
+        if taken >= num_val:
+            break
+        if not selected[image]:
+            take(image)
+    return np.flatnonzero(selected), class_totals, val_counts
+
+def write_split_manifest(manifest_path, val_images, val_fraction, seed, class_totals=None, val_counts=None):
+    manifest = {"val_percentage": val_fraction, "seed": seed, "val": sorted(val_images)}
+    if class_totals is not None:
+        manifest["classes"] = {str(c): [int(total), int(val)] for c, (total, val) in enumerate(zip(class_totals, val_counts))}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+def apply_split(val_images, images, images_folder, labels_folder, val_images_folder, val_labels_folder, mode="move", train_images_folder=None, train_labels_folder=None):
+    """Moves (or links) the chosen validation images and their labels. In link modes the other files go to the train folders when given."""
     # Move images
-    move_files(val_images, images_folder, val_images_folder)
+    move_files(val_images, images_folder, val_images_folder, mode)
+    
+    # Move corresponding labels, the index tells which exist without a stat per file
+    labels = load_index(labels_folder, recursive=False).labels(recursive=False)
+    val_labels = [os.path.basename(labels[Path(f).stem]) for f in val_images if Path(f).stem in labels]
+    if len(val_labels) < len(val_images):
+        print(f"{len(val_images) - len(val_labels)} selected images have no label.")
+    move_files(val_labels, labels_folder, val_labels_folder, mode)
+
+    if mode != "move":
+        if train_images_folder and train_labels_folder:
+            selected = set(val_images)
+            train_images = [f for f in images if f not in selected]
+            move_files(train_images, images_folder, train_images_folder, mode)
+            move_files([os.path.basename(labels[Path(f).stem]) for f in train_images if Path(f).stem in labels], labels_folder, train_labels_folder, mode)
+            print(f"Linked {len(train_images)} images and their labels to the train folders.")
+        else:
+            print("No train folders given: the source folders still hold the validation files.")
+
+    print(f"{'Moved' if mode == 'move' else 'Linked'} {len(val_images)} images and their corresponding labels to the validation folders.")
+
+def select_and_move_files(images_folder, labels_folder, val_images_folder, val_labels_folder, val_percentage, mode="move", train_images_folder=None, train_labels_folder=None,
+                          stratified=False, seed=None, manifest_path=None):
+    """Select 5% of files and move them to validation folders.
+    stratified keeps every class represented in val in proportion, see stratified_split. The choice is written to manifest_path when given."""
+    # Sorted, listing order differs between machines and copies, a seeded split must not depend on it
+    images = sorted(os.path.basename(path) for path in load_index(images_folder, recursive=False).paths(('.jpg', '.png', '.jpeg', '.webp'), recursive=False))
     
-    # Move corresponding labels
-    val_labels = [Path(f).stem + '.txt' for f in val_images]
-    move_files(val_labels, labels_folder, val_labels_folder)
+    if stratified:
+        labels = load_index(labels_folder, recursive=False).labels(recursive=False)
+        counts = class_count_matrix([labels.get(Path(f).stem) for f in images])
+        indices, class_totals, val_counts = stratified_split(counts, val_percentage, seed)
+        val_images = [images[i] for i in indices]
+        for c, (total, val) in enumerate(zip(class_totals, val_counts)):
+            print(f"Class {c}: {val}/{total} images in val")
+    else:
+        num_val_images = max(1, int(len(images) * val_percentage))
+        val_images = random.Random(seed).sample(images, num_val_images) if seed is not None else random.sample(images, num_val_images)
+        class_totals = val_counts = None
+
+    if manifest_path:
+        write_split_manifest(manifest_path, val_images, val_percentage, seed, class_totals, val_counts)
+        print(f"Split manifest: {manifest_path}")
+    apply_split(val_images, images, images_folder, labels_folder, val_images_folder, val_labels_folder, mode, train_images_folder, train_labels_folder)
 
-    print(f"Moved {num_val_images} images and their corresponding labels to the validation folders.")
+def apply_split_manifest(manifest_path, images_folder, labels_folder, val_images_folder, val_labels_folder, mode="move", train_images_folder=None, train_labels_folder=None):
+    """Applies a split written earlier by select_and_move_files."""
+    with open(manifest_path) as f:
+        val_images = json.load(f)["val"]
+    images = [os.path.basename(path) for path in load_index(images_folder, recursive=False).paths(('.jpg', '.png', '.jpeg', '.webp'), recursive=False)]
+    present = set(images)
+    missing = [f for f in val_images if f not in present]
+    if missing:
+        print(f"{len(missing)} images of the manifest are not in {images_folder}, skipped.")
+    apply_split([f for f in val_images if f in present], images, images_folder, labels_folder, val_images_folder, val_labels_folder, mode, train_images_folder, train_labels_folder)
 
 def main():
     parser = argparse.ArgumentParser(description="Randomly select 5% of images and labels and move them to /val/images and /val/labels folders.")
@@ -35,11 +234,23 @@ def main():
     parser.add_argument("labels_folder", help="Path to the labels folder.")
     parser.add_argument("val_images_folder", help="Path to the validation images folder.")
     parser.add_argument("val_labels_folder", help="Path to the validation labels folder.")
-    parser.add_argument("--val_percentage", type=float, default=0.05, help="Percentage of data to move to validation. Default is 5%.")
+    parser.add_argument("--val_percentage", type=float, default=0.05, help="Percentage of data to move to validation. Default is 5%%.")
+    parser.add_argument("--mode", choices=MODES, default="move", help="move (default), or hardlink/symlink to build the split without copying data.")
+    parser.add_argument("--train_images_folder", default=None, help="Link modes: folder receiving links to the remaining images.")
+    parser.add_argument("--train_labels_folder", default=None, help="Link modes: folder receiving links to the remaining labels.")
+    parser.add_argument("--stratified", action="store_true", help="Class-stratified selection from the YOLO labels, so rare classes stay in val.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for a reproducible split.")
+    parser.add_argument("--manifest", default=None, help="Write the chosen split to this JSON file.")
+    parser.add_argument("--apply", default=None, metavar="MANIFEST", help="Apply a split manifest written earlier instead of selecting.")
     
     args = parser.parse_args()
 
-    select_and_move_files(args.images_folder, args.labels_folder, args.val_images_folder, args.val_labels_folder, args.val_percentage)
+    if args.apply:
+        apply_split_manifest(args.apply, args.images_folder, args.labels_folder, args.val_images_folder, args.val_labels_folder,
+                             args.mode, args.train_images_folder, args.train_labels_folder)
+        return
+    select_and_move_files(args.images_folder, args.labels_folder, args.val_images_folder, args.val_labels_folder, args.val_percentage,
+                          args.mode, args.train_images_folder, args.train_labels_folder, args.stratified, args.seed, args.manifest)
 
 if __name__ == "__main__":
     main()
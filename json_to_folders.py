@@ -1,77 +1,171 @@
-# sorts files into folders based on selected attributes values of a JSON file. 
+# sorts files into folders based on selected attributes values of a JSON file.
+# The JSON is a list of items, each with attributes and a list of 'instances' naming files; it is parsed one item at a time, memory stays flat on huge files.
+# python3 json_to_folders.py data.json files_folder --folder-attribute label --filename-attribute file [--limit N] [--workers N]
+# python3 json_to_folders.py data.json --list-attributes   prints the attributes found
+# Without the attributes, everything is asked interactively.
 import os
 import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataset_index import load_index
 
-# Prompt for the location of the JSON file
-json_file_path = input("Enter the path to the JSON file: ")
-
-# Load the JSON data
-with open(json_file_path, 'r') as file:
-    data = json.load(file)
-
-#This script sorts files into folders based on attributes found in a JSON file and chosen by user prompt.
-#It prompts for the number of files to process in each folder, with the option to process all files.
-print("Attributes found in the JSON data:")
-attributes = set()
-for item in data:
-    for key in item.keys():
-        attributes.add(key)
-    for instance in item['instances']:
-        for key in instance.keys():
-            attributes.add(key)
-print(attributes)
-
-# Prompt for input to choose the attributes for folder names and new filenames
-folder_attribute = input("Enter the attribute to use for folder names: ")
-filename_attribute = input("Enter the attribute to use for new filenames: ")
-
-# Prompt for the directory where the files are stored
-file_directory = input("Enter the path to the directory where the files are stored: ")
-
-# Prompt for the number of files to process in each folder
-num_files_prompt = "Enter the number of files to process in each folder (leave blank for all): "
-num_files = input(num_files_prompt)
-if num_files.isdigit():
-    num_files = int(num_files)
-else:
-    num_files = None
-
-# Iterate through the data and move the files
-for item in data:
-    folder_name = item.get(folder_attribute, None)
-    if folder_name is None:
-        continue  # Skip this item if the folder attribute is missing
-    folder_name = folder_name.strip(' "\'')
-
-    instances = item.get('instances', [])
-    # Create the directory for this folder if it doesn't exist
-    folder_directory = os.path.join(file_directory, folder_name)
-    if not os.path.exists(folder_directory):
-        os.makedirs(folder_directory)
-
-    # Move each file to the folder directory, up to the specified limit
-    files_moved = 0
-    for instance in instances:
-        if num_files is not None and files_moved >= num_files:
-            break  # Stop moving files if we've reached the limit
-
-        file_name = instance.get(filename_attribute, None)
-        if file_name is None:
-            continue  # Skip this instance if the filename attribute is missing
-        file_name = file_name.strip(' "\'')
-
-        # Determine the file extension
-        original_file_path = os.path.join(file_directory, file_name)
-        _, file_extension = os.path.splitext(original_file_path)
-
-        # Set the destination path with the correct extension
-        destination_file_name = file_name + file_extension
-        destination_path = os.path.join(folder_directory, destination_file_name)
-
-        # Check if the file exists and move it
-        if os.path.exists(original_file_path):
+READ_SIZE = 1024 * 1024
+BATCH_SIZE = 512  # moves per task, all into the same folder
+
+def iter_items(json_file_path, read_size=READ_SIZE):
+    """Yields the items of a JSON file holding one top-level list, decoding them one by one from a sliding buffer."""
+    decoder = json.JSONDecoder()
+    with open(json_file_path, 'r', encoding='utf-8') as file:
+        buffer, pos, eof = "", 0, False
+        separators = " \t\r\n"
+        in_list = False
+        while True:
+            # Skip whitespace, and the commas between items, reading on when the buffer is used up
+            while pos < len(buffer) and buffer[pos] in separators:
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError(f"{json_file_path}: unexpected end of file")
+                buffer, pos = file.read(read_size), 0
+                eof = not buffer
+                continue
+            if not in_list:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{json_file_path}: expected a list of items")
+                in_list, separators = True, " \t\r\n,"
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                if end == len(buffer) and not eof:
+                    raise json.JSONDecodeError("value may continue", buffer, end)  # a number cut at the buffer end
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = file.read(max(read_size, len(buffer) - pos))  # doubles the window for items larger than it
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield item
+            pos = end
+
+def collect_attributes(json_file_path):
+    """Attributes of the items and of their instances."""
+    attributes = set()
+    for item in iter_items(json_file_path):
+        attributes.update(item.keys())
+        for instance in item.get('instances', []):
+            attributes.update(instance.keys())
+    return attributes
+
+def move_batch(moves, folder_directory):
+    moved = 0
+    for original_file_path, destination_path in moves:
+        try:
             os.rename(original_file_path, destination_path)
-            print(f'Moved {destination_file_name} to {folder_directory}')
-            files_moved += 1
-        else:
-            print(f'File {destination_file_name} not found in {file_directory}')
+        except OSError as e:
+            print(f'Failed to move {original_file_path}: {e}')
+            continue
+        print(f'Moved {os.path.basename(destination_path)} to {folder_directory}')
+        moved += 1
+    return moved
+
+def sort_files(json_file_path, folder_attribute, filename_attribute, file_directory, num_files=None, max_workers=None):
+    """Moves each item's instance files into a folder named after the item's folder_attribute, at most num_files per item.
+    Files are looked up in one listing of file_directory, moves run in a thread pool in batches per destination folder. Returns how many were moved."""
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+    index = load_index(file_directory, recursive=False)
+    claimed = set()  # listed files already planned, a file named twice is only moved once, like before
+    moved = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+
+        def submit(moves, folder_directory):
+            nonlocal pending, moved
+            pending.add(executor.submit(move_batch, moves, folder_directory))
+            if len(pending) >= max_workers * 2:  # bounded, the JSON may be much larger than memory
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                moved += sum(future.result() for future in done)
+
+        for item in iter_items(json_file_path):
+            folder_name = item.get(folder_attribute, None)
+            if folder_name is None:
+                continue  # Skip this item if the folder attribute is missing
+            folder_name = folder_name.strip(' "\'')
+
+            # Create the directory for this folder if it doesn't exist
+            folder_directory = os.path.join(file_directory, folder_name)
+            os.makedirs(folder_directory, exist_ok=True)
+
+            # Plan each file's move to the folder directory, up to the specified limit
+            moves = []
+            for instance in item.get('instances', []):
+                if num_files is not None and len(moves) >= num_files:
+                    break  # Stop moving files if we've reached the limit
+
+                file_name = instance.get(filename_attribute, None)
+                if file_name is None:
+                    continue  # Skip this instance if the filename attribute is missing
+                file_name = file_name.strip(' "\'')
+
+                # Determine the file extension
+                original_file_path = os.path.join(file_directory, file_name)
+                _, file_extension = os.path.splitext(original_file_path)
+
+                # Set the destination path with the correct extension
+                destination_file_name = file_name + file_extension
+                destination_path = os.path.join(folder_directory, destination_file_name)
+
+                if index.exists(original_file_path) and original_file_path not in claimed:
+                    claimed.add(original_file_path)
+                    moves.append((original_file_path, destination_path))
+                    if len(moves) % BATCH_SIZE == 0:
+                        submit(moves[-BATCH_SIZE:], folder_directory)
+                else:
+                    print(f'File {destination_file_name} not found in {file_directory}')
+            if len(moves) % BATCH_SIZE:
+                submit(moves[-(len(moves) % BATCH_SIZE):], folder_directory)
+
+        moved += sum(future.result() for future in pending)
+    return moved
+
+def main():
+    parser = argparse.ArgumentParser(description="Sorts files into folders based on attribute values of a JSON file.")
+    parser.add_argument("json_file", nargs="?", help="JSON list of items with 'instances'")
+    parser.add_argument("file_directory", nargs="?", help="folder holding the files")
+    parser.add_argument("--folder-attribute", help="item attribute used for folder names")
+    parser.add_argument("--filename-attribute", help="instance attribute holding the file names")
+    parser.add_argument("--limit", type=int, default=None, help="files per item, default: all")
+    parser.add_argument("--workers", type=int, default=None, help="move threads")
+    parser.add_argument("--list-attributes", action="store_true", help="print the attributes found and exit")
+    args = parser.parse_args()
+
+    # Prompt for the location of the JSON file
+    json_file_path = args.json_file or input("Enter the path to the JSON file: ")
+    if args.list_attributes or not (args.folder_attribute and args.filename_attribute):
+        print("Attributes found in the JSON data:")
+        print(collect_attributes(json_file_path))
+        if args.list_attributes:
+            return
+
+    # Prompt for input to choose the attributes for folder names and new filenames
+    folder_attribute = args.folder_attribute or input("Enter the attribute to use for folder names: ")
+    filename_attribute = args.filename_attribute or input("Enter the attribute to use for new filenames: ")
+
+    # Prompt for the directory where the files are stored
+    file_directory = args.file_directory or input("Enter the path to the directory where the files are stored: ")
+
+    # Prompt for the number of files to process in each folder
+    num_files = args.limit
+    if num_files is None and not (args.folder_attribute and args.filename_attribute):
+        num_files = input("Enter the number of files to process in each folder (leave blank for all): ")
+        num_files = int(num_files) if num_files.isdigit() else None
+
+    moved = sort_files(json_file_path, folder_attribute, filename_attribute, file_directory, num_files, args.workers)
+    print(f"{moved} files moved")
+
+if __name__ == "__main__":
+    main()
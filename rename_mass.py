@@ -1,84 +1,158 @@
 # Renames each dataset's image/label file pairs to a shortt random alphanumerical filename with a sequence number. 
 # python3 script.py labels_path images_path
+# Planned renames are journaled first: after a crash, add --resume to finish or --rollback to undo.
+# python3 script.py --benchmark times the pairing on synthetic datasets up to millions of files
 
 import os
+import json
 import random
 import string
 import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataset_index import load_index
+
+def pair_files(image_files, label_files):
+    """Pairs images and labels by file stem through a stem -> label index, linear in the number of files."""
+    label_index = {}
+    for lbl_file in label_files:
+        label_index.setdefault(os.path.splitext(os.path.basename(lbl_file))[0], lbl_file)  # first match wins, as before
 
-def get_file_pairs(image_folder, label_folder, image_extensions=['.jpg', '.webp', '.png'], label_extension='.txt'):
-    image_files = []
-    label_files = []
-    for root, _, files in os.walk(image_folder):
-        for file in files:
-            if any(file.lower().endswith(ext) for ext in image_extensions):
-                image_files.append(os.path.join(root, file))
-    
-    for root, _, files in os.walk(label_folder):
-        for file in files:
-            if file.lower().endswith(label_extension):
-                label_files.append(os.path.join(root, file))
-    
     paired_files = []
     unpaired_images = []
-    unpaired_labels = []
-
+    image_stems = set()
     for img_file in image_files:
         base_name = os.path.splitext(os.path.basename(img_file))[0]
-        matching_label = None
-        for lbl_file in label_files:
-            if os.path.splitext(os.path.basename(lbl_file))[0] == base_name:
-                matching_label = lbl_file
-                break
+        image_stems.add(base_name)
+        matching_label = label_index.get(base_name)
         if matching_label:
             paired_files.append((img_file, matching_label))
         else:
             unpaired_images.append(img_file)
-    
-    for lbl_file in label_files:
-        base_name = os.path.splitext(os.path.basename(lbl_file))[0]
-        matching_image = None
-        for img_file in image_files:
-            if os.path.splitext(os.path.basename(img_file))[0] == base_name:
-                matching_image = img_file
-                break
-        if not matching_image:
-            unpaired_labels.append(lbl_file)
 
+    unpaired_labels = [lbl_file for lbl_file in label_files if os.path.splitext(os.path.basename(lbl_file))[0] not in image_stems]
     return paired_files, unpaired_images, unpaired_labels
 
+def get_file_pairs(image_folder, label_folder, image_extensions=['.jpg', '.webp', '.png'], label_extension='.txt', image_index=None, label_index=None):
+    """Pairs of the two folders. image_index/label_index are their load_index results when the caller already has them."""
+    image_files = (image_index or load_index(image_folder)).paths(tuple(image_extensions))
+    label_files = (label_index or load_index(label_folder)).paths((label_extension,))
+    return pair_files(image_files, label_files)
+
+def benchmark(sizes=(10_000, 100_000, 1_000_000, 3_000_000)):
+    """Times pair_files on synthetic listings, time per file stays flat as the dataset grows."""
+    for size in sizes:
+        image_files = [os.path.join("images", f"img_{i:07d}.jpg") for i in range(size)]
+        label_files = [os.path.join("labels", f"img_{i:07d}.txt") for i in range(0, size, 2)]  # half of the images are labeled
+        started = time.perf_counter()
+        paired_files, unpaired_images, unpaired_labels = pair_files(image_files, label_files)
+        elapsed = time.perf_counter() - started
+        print(f"{size:>9} images: {elapsed:.2f}s, {elapsed / size * 1e6:.2f} µs/image, {len(paired_files)} paired, {len(unpaired_images)} unpaired images")
+
 def generate_random_string(length=5):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
-def rename_files(paired_files, image_folder, label_folder):
+JOURNAL_NAME = ".rename_journal.json"
+
+def plan_renames(paired_files, image_folder, label_folder, image_index=None, label_index=None):
+    """List of (source, destination) moves for every pair. New names never collide with each other nor with files already in the folders."""
+    indexes = (image_index or load_index(image_folder, recursive=False), label_index or load_index(label_folder, recursive=False))
+    taken = {os.path.splitext(os.path.basename(path))[0] for index in indexes for path in index.paths(recursive=False)}
+    moves = []
     for i, (img_file, lbl_file) in enumerate(paired_files):
         new_base_name = f"{generate_random_string()}_{i+1:04d}"
+        while new_base_name in taken:
+            new_base_name = f"{generate_random_string()}_{i+1:04d}"
+        taken.add(new_base_name)
+
         img_extension = os.path.splitext(img_file)[1]
         lbl_extension = os.path.splitext(lbl_file)[1]
+        moves.append((img_file, os.path.join(image_folder, new_base_name + img_extension)))
+        moves.append((lbl_file, os.path.join(label_folder, new_base_name + lbl_extension)))
+    return moves
+
+def write_journal(journal_path, moves):
+    """Writes the planned moves and syncs them to disk before anything is renamed."""
+    tmp_path = journal_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"moves": moves}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, journal_path)
+
+def read_journal(journal_path):
+    with open(journal_path) as f:
+        return [tuple(move) for move in json.load(f)["moves"]]
+
+def apply_moves(moves, reverse=False):
+    """Renames one batch, skipping moves already done (or, reversed, not done yet). Returns (renamed, missing)."""
+    renamed = missing = 0
+    for src, dst in moves:
+        if reverse:
+            src, dst = dst, src
+        try:
+            os.rename(src, dst)
+            renamed += 1
+        except FileNotFoundError:
+            missing += 1  # already moved by an interrupted run
+    return renamed, missing
+
+def run_journal(journal_path, reverse=False, max_workers=None):
+    """Applies (or rolls back) every move of the journal with a thread pool, one batch per source directory, then removes the journal."""
+    batches = defaultdict(list)
+    for src, dst in read_journal(journal_path):
+        batches[os.path.dirname(dst if reverse else src)].append((src, dst))
+
+    renamed = missing = 0
+    with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+        for batch_renamed, batch_missing in executor.map(lambda batch: apply_moves(batch, reverse), batches.values()):
+            renamed += batch_renamed
+            missing += batch_missing
 
-        new_img_file = os.path.join(image_folder, new_base_name + img_extension)
-        new_lbl_file = os.path.join(label_folder, new_base_name + lbl_extension)
+    os.remove(journal_path)
+    print(f"{'Rolled back' if reverse else 'Renamed'} {renamed} files, {missing} already in place.")
 
-        os.rename(img_file, new_img_file)
-        os.rename(lbl_file, new_lbl_file)
+def rename_files(paired_files, image_folder, label_folder, image_index=None, label_index=None):
+    """Journal first, rename second: a crash leaves a journal that --resume completes or --rollback undoes."""
+    journal_path = os.path.join(label_folder, JOURNAL_NAME)
+    write_journal(journal_path, plan_renames(paired_files, image_folder, label_folder, image_index, label_index))
+    run_journal(journal_path)
 
-        print(f"Renamed {img_file} to {new_img_file}")
-        print(f"Renamed {lbl_file} to {new_lbl_file}")
+def main(image_folder, label_folder, action=None):
+    journal_path = os.path.join(label_folder, JOURNAL_NAME)
+    if action:
+        if not os.path.exists(journal_path):
+            print(f"No journal found at {journal_path}, nothing to {action}.")
+            return
+        run_journal(journal_path, reverse=(action == "rollback"))
+        return
+    if os.path.exists(journal_path):
+        print(f"An interrupted run left {journal_path}, rerun with --resume or --rollback.")
+        return
 
-def main(image_folder, label_folder):
-    paired_files, unpaired_images, unpaired_labels = get_file_pairs(image_folder, label_folder)
+    # Each folder is indexed once, for the pairing and for the collision check
+    image_index = load_index(image_folder)
+    label_index = load_index(label_folder)
+    paired_files, unpaired_images, unpaired_labels = get_file_pairs(image_folder, label_folder, image_index=image_index, label_index=label_index)
     print(f"Found {len(paired_files)} paired files.")
     print(f"Found {len(unpaired_images)} unpaired image files.")
     print(f"Found {len(unpaired_labels)} unpaired label files.")
 
     if paired_files:
-        rename_files(paired_files, image_folder, label_folder)
+        rename_files(paired_files, image_folder, label_folder, image_index, label_index)
 
 if __name__ == "__main__":
+    if sys.argv[1:] == ["--benchmark"]:
+        benchmark()
+        sys.exit(0)
+    action = None
+    if len(sys.argv) == 4 and sys.argv[3] in ("--resume", "--rollback"):
+        action = sys.argv.pop()[2:]
     if len(sys.argv) != 3:
-        print("Usage: python script.py <labels_path> <images_path>")
+        print("Usage: python script.py <labels_path> <images_path> [--resume | --rollback]")
         sys.exit(1)
     
     label_folder = sys.argv[1]
     image_folder = sys.argv[2]
-    main(image_folder, label_folder)
+    main(image_folder, label_folder, action)
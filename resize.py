@@ -1,67 +1,461 @@
 import os
+import io
+import json
+import time
+import shutil
+import hashlib
 import argparse
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from PIL import Image
+from dataset_index import load_index, CACHE_DIR
+from file_copy import copy_file
 
-def resize_image(image_path, output_folder, width, height, resample, resample_name):
-    """Resizes images of a folder, save into a new folder, Lanczos is the best quality upsampling and downsampling, also known as antialiasing."""
+REDUCING_GAP = 2.0  # JPEG draft and reduce() only shrink down to twice the target size, the resample filter does the rest
+CHUNK_SIZE = 32  # images per task
+PLACE_CHUNK_SIZE = 1024  # cached outputs per task
+RESIZE_CACHE_DIR = os.path.join(CACHE_DIR, "resize")
+RESIZE_CACHE_LIMIT = int(os.environ.get("RESIZE_CACHE_LIMIT", 20 * 1024 ** 3))  # bytes
+CACHE_VERSION = "1"  # bump when the resize or encode settings change, old entries then miss
+CATALOG_VERSION = 2
+
+def output_name(base_name, ext, size, resample_name, several_sizes):
+    size_tag = f"_{size[0]}x{size[1]}" if several_sizes else ""
+    return f"{base_name}{size_tag}_{resample_name}{ext}"
+
+class ResizeCache:
+    """Content-addressed store of resized outputs, shared by every folder resized on this machine.
+    An output is keyed by the sha1 of its source's bytes, the requested size, the resample method and the format; a copy of it is kept
+    in objects/, so a cache hit is a file copy, not a decode. Copies, never hardlinks: editing an output cannot change the cache or other outputs,
+    and copy_file_range shares the blocks on filesystems that can. The size and mtime of every output placed are recorded, an output
+    still as it was placed is not copied again. Source hashes are remembered by (size, mtime), unchanged files are not read again.
+    The store is bounded to limit bytes, least recently used outputs are evicted first, and the sources and outputs only they served are forgotten."""
+
+    def __init__(self, cache_dir=RESIZE_CACHE_DIR, limit=RESIZE_CACHE_LIMIT):
+        self.cache_dir = cache_dir
+        self.limit = limit
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.sources = {}  # source path -> [size, mtime_ns, sha1, width, height]
+        self.objects = {}  # key -> [bytes, last used, source sha1]
+        self.outputs = {}  # output path -> [key, size, mtime_ns] of the copy placed there
+        self.hits = self.misses = self.evicted = 0
+        try:
+            with open(os.path.join(cache_dir, "catalog.json")) as f:
+                catalog = json.load(f)
+            if catalog.get("version") != CATALOG_VERSION:
+                raise ValueError("old catalog")
+            self.sources, self.objects, self.outputs = catalog["sources"], catalog["objects"], catalog["outputs"]
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(self.objects_dir, ignore_errors=True)  # objects no catalog knows would never be evicted
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    @staticmethod
+    def key(digest, size, resample_name, ext):
+        spec = f"{CACHE_VERSION}:{digest}:{size[0]}x{size[1]}:{resample_name}"
+        return hashlib.sha1(spec.encode()).hexdigest() + ext.lower()
+
+    def object_path(self, key):
+        return object_path(self.objects_dir, key)
+
+    def known_source(self, path, size, mtime):
+        """[sha1, width, height] of an unchanged source, None when it is new or changed."""
+        entry = self.sources.get(path)
+        if entry and entry[0] == size and entry[1] == mtime:
+            return entry[2:]
+        return None
+
+    def hit(self, image_path, stat, output_folder, sizes, resample_methods):
+        """[(key, object path, output path, recorded [size, mtime] or None)] of the outputs of an unchanged source, None unless all are stored."""
+        entry = self.known_source(image_path, *stat)
+        if not entry:
+            return None
+        items = []
+        for key, output_path in cached_outputs(image_path, entry, output_folder, sizes, resample_methods):
+            if key not in self.objects:
+                return None
+            recorded = self.outputs.get(output_path)
+            items.append((key, self.object_path(key), output_path, recorded[1:] if recorded and recorded[0] == key else None))
+        return items
+
+    def placed(self, key, output_path, size, mtime):
+        if key in self.objects:
+            self.objects[key][1] = time.time()
+            self.outputs[output_path] = [key, size, mtime]
+
+    def stored(self, key, digest, object_size, output_path, size, mtime):
+        self.objects[key] = [object_size, time.time(), digest]
+        self.outputs[output_path] = [key, size, mtime]
+
+    def evict(self):
+        total = sum(entry[0] for entry in self.objects.values())
+        for key, (size, _, _) in sorted(self.objects.items(), key=lambda item: item[1][1]):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(self.object_path(key))
+            except OSError:
+                pass
+            del self.objects[key]
+            total -= size
+            self.evicted += 1
+        return total
+
+    def save(self):
+        total = self.evict()
+        # Sources and outputs are only kept while one of their objects is, the catalog stays as bounded as the store
+        digests = {entry[2] for entry in self.objects.values()}
+        self.sources = {path: entry for path, entry in self.sources.items() if entry[2] in digests}
+        self.outputs = {path: entry for path, entry in self.outputs.items() if entry[0] in self.objects}
+        tmp_path = os.path.join(self.cache_dir, "catalog.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CATALOG_VERSION, "sources": self.sources, "objects": self.objects, "outputs": self.outputs}, f, separators=(",", ":"))
+        os.replace(tmp_path, os.path.join(self.cache_dir, "catalog.json"))
+        return total
+
+    def summary(self):
+        looked_up = self.hits + self.misses
+        rate = 100 * self.hits / looked_up if looked_up else 0
+        return f"Cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), {self.evicted} evicted"
+
+def object_path(objects_dir, key):
+    return os.path.join(objects_dir, key[:2], key)
+
+def copy_into(source, destination):
+    """Copies source to destination through a temporary name, replacing it only once the copy is complete."""
+    tmp_path = f"{destination}.{os.getpid()}.tmp"  # workers may store the same object at once
     try:
-        with Image.open(image_path) as img:
-            # Determine height if not provided to maintain aspect ratio
-            if height is None:
-                aspect_ratio = img.height / img.width
-                height = int(width * aspect_ratio)
+        copy_file(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except OSError:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def target_size(img_size, width, height):
+    """(width, height), height inferred from the aspect ratio when None."""
+    if height is None:
+        height = int(width * img_size[1] / img_size[0])
+    return width, height
+
+def draft(img, largest):
+    """Decodes a large JPEG at the smallest DCT scale still REDUCING_GAP times larger than largest, a no-op for other formats."""
+    if img.width > largest[0] * REDUCING_GAP and img.height > largest[1] * REDUCING_GAP:
+        img.draft(img.mode, (int(largest[0] * REDUCING_GAP), int(largest[1] * REDUCING_GAP)))
+    img.load()
+
+def save_resized(resized_image, output_path, ext, img_format):
+    # Written next to the output then renamed, a reader never sees a half written output
+    tmp_path = output_path + ".tmp"
+    if ext.lower() in [".jpg", ".jpeg"]:
+        resized_image.save(tmp_path, format=img_format, quality=96) # Explicit quality because PIL's default is 75
+    elif ext.lower() == ".png":
+        resized_image.save(tmp_path, format=img_format, compress_level=1)  # No compression for PNG
+    else:
+        resized_image.save(tmp_path, format=img_format)
+    os.replace(tmp_path, output_path)
 
-            # Resize the image while preserving the alpha channel if present
-            resized_image = img.resize((width, height), resample=resample)
+def resize_image(image_path, output_folder, sizes, resample_methods, data=None):
+    """Resizes one image to every (width, height) of sizes with every method of resample_methods, decoding it once.
+    Lanczos is the best quality upsampling and downsampling, also known as antialiasing.
+    Large JPEG downscales are decoded at a reduced scale (draft) and shrunk with reduce() before the final filter.
+    data, the bytes of the image already read, is decoded instead of reading image_path."""
+    outputs = []
+    try:
+        with Image.open(image_path if data is None else io.BytesIO(data)) as img:
+            img_format = img.format
+            targets = [target_size(img.size, width, height) for width, height in sizes]
+            draft(img, (max(w for w, _ in targets), max(h for _, h in targets)))
 
             base_name, ext = os.path.splitext(os.path.basename(image_path))
-            output_path = os.path.join(output_folder, f"{base_name}_{resample_name}{ext}")
-            if ext.lower() in [".jpg", ".jpeg"]:
-                resized_image.save(output_path, format=img.format, quality=96) # Explicit quality because PIL's default is 75 
-            elif ext.lower() == ".png":
-                resized_image.save(output_path, format=img.format, compress_level=1)  # No compression for PNG
-            else:
-                resized_image.save(output_path, format=img.format)
-            print(f"Resized and saved: {output_path}")
+            for size in targets:
+                for resample_name, resample in resample_methods.items():
+                    # Resize the image while preserving the alpha channel if present
+                    resized_image = img.resize(size, resample=resample, reducing_gap=REDUCING_GAP)
+                    output_path = os.path.join(output_folder, output_name(base_name, ext, size, resample_name, len(sizes) > 1))
+                    save_resized(resized_image, output_path, ext, img_format)
+                    outputs.append(output_path)
+                    print(f"Resized and saved: {output_path}")
     except Exception as e:
         print(f"Failed to process image {image_path}: {e}")
+    return outputs
+
+def resize_chunk(image_paths, output_folder, sizes, resample_methods, objects_dir=None):
+    """Resizes a chunk of images, returns their outputs. With the objects_dir of a ResizeCache, the outputs are also copied into the store
+    and (path, (size, mtime), [sha1, width, height], [(key, output path, object bytes, output size, output mtime)]) of each source is returned.
+    The source is then read once: the stat, the hash and the decoded image all come from the same bytes, a file rewritten meanwhile is not cached."""
+    results = []
+    for image_path in image_paths:
+        if objects_dir is None:
+            results.append(resize_image(image_path, output_folder, sizes, resample_methods))
+            continue
+        try:
+            with open(image_path, "rb") as f:
+                before = os.fstat(f.fileno())
+                data = f.read()
+                after = os.fstat(f.fileno())
+        except OSError as e:
+            print(f"Failed to process image {image_path}: {e}")
+            continue
+        unchanged = (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns) and len(data) == after.st_size
+        if resize_image(image_path, output_folder, sizes, resample_methods, data) and unchanged:
+            with Image.open(io.BytesIO(data)) as img:  # header only
+                entry = [hashlib.sha1(data).hexdigest(), *img.size]
+            results.append((image_path, (after.st_size, after.st_mtime_ns), entry, store_outputs(objects_dir, image_path, entry, output_folder, sizes, resample_methods)))
+    return results
+
+def store_outputs(objects_dir, image_path, entry, output_folder, sizes, resample_methods):
+    """Copies the fresh outputs of a source into the store. Returns (key, output path, object bytes, output size, output mtime) of each one stored."""
+    stored = []
+    for key, output_path in cached_outputs(image_path, entry, output_folder, sizes, resample_methods):
+        path = object_path(objects_dir, key)
+        try:
+            if not os.path.exists(path):  # else the same content was already stored from another source
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                copy_into(output_path, path)
+            stat = os.stat(output_path)
+            stored.append((key, output_path, os.path.getsize(path), stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            pass
+    return stored
+
+def place_chunk(items):
+    """Puts cached outputs in place: an output still as recorded is left alone, the others are copied from the store.
+    Returns (source path, key, output path, size, mtime) of each output, size None when its object is gone from the store."""
+    results = []
+    for image_path, key, stored_path, output_path, recorded in items:
+        try:
+            stat = os.stat(output_path)
+            if recorded and [stat.st_size, stat.st_mtime_ns] == list(recorded):
+                results.append((image_path, key, output_path, stat.st_size, stat.st_mtime_ns))
+                continue
+        except OSError:
+            pass
+        try:
+            copy_into(stored_path, output_path)
+            stat = os.stat(output_path)
+            results.append((image_path, key, output_path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            results.append((image_path, key, output_path, None, None))
+    return results
+
+def cached_outputs(image_path, entry, output_folder, sizes, resample_methods):
+    """[(key, output path)] of every output of a source whose hash and dimensions are known."""
+    digest, width, height = entry
+    base_name, ext = os.path.splitext(os.path.basename(image_path))
+    outputs = []
+    for size in sizes:
+        target = target_size((width, height), *size)
+        for resample_name in resample_methods:
+            outputs.append((ResizeCache.key(digest, target, resample_name, ext), os.path.join(output_folder, output_name(base_name, ext, target, resample_name, len(sizes) > 1))))
+    return outputs
 
-def process_images(input_folder, output_folder, width, height, resample_methods):
-    """Process all images in the input folder concurrently."""
+def process_images(input_folder, output_folder, width, height, resample_methods, sizes=None, max_workers=None, cache=None):
+    """Process all images in the input folder concurrently, one task per chunk of images, a bounded number of tasks in flight.
+    sizes is a list of (width, height) to produce instead of the single width, height.
+    With a ResizeCache, unchanged images whose outputs are cached are copied into place by the pool instead of being resized,
+    outputs still as they were placed are left alone."""
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
+    sizes = sizes or [(width, height)]
+    max_workers = max_workers or os.cpu_count() or 1
 
-    image_files = [f for f in os.listdir(input_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))]
-
-    with ProcessPoolExecutor(max_workers=4) as executor:
-        futures = []
-        for resample_name, resample_method in resample_methods.items():
-            for image_file in image_files:
-                futures.append(
-                    executor.submit(
-                        resize_image, os.path.join(input_folder, image_file), output_folder, width, height, resample_method, resample_name
-                    )
-                )
-        for future in as_completed(futures):
-            try:
-                future.result()  # To catch exceptions if any
-            except Exception as exc:
-                print(f"Generated an exception: {exc}")
+    image_paths = load_index(input_folder, recursive=False).paths(('.png', '.jpg', '.jpeg', '.bmp'), recursive=False)
+    if cache:
+        hits, misses = [], []
+        for image_path in image_paths:
+            stat = os.stat(image_path)  # fresh, the folder index does not see files rewritten in place
+            items = cache.hit(image_path, (stat.st_size, stat.st_mtime_ns), output_folder, sizes, resample_methods)
+            if items:
+                hits.extend((image_path, *item) for item in items)
+            else:
+                misses.append(image_path)
+
+        broken = set()
+        def placed(results):
+            for image_path, key, output_path, size, mtime in results:
+                if size is None:
+                    broken.add(image_path)
+                    cache.objects.pop(key, None)  # removed from the store behind our back
+                else:
+                    cache.placed(key, output_path, size, mtime)
+
+        place_chunks = ((hits[i:i + PLACE_CHUNK_SIZE],) for i in range(0, len(hits), PLACE_CHUNK_SIZE))
+        run_chunks(place_chunk, place_chunks, max_workers, placed)
+        cache.hits += len({item[0] for item in hits} - broken)
+        image_paths = misses + sorted(broken)
+
+    def store(results):
+        for image_path, stat, entry, stored in results:
+            cache.misses += 1
+            cache.sources[image_path] = [*stat, *entry]
+            for key, output_path, object_size, size, mtime in stored:
+                cache.stored(key, entry[0], object_size, output_path, size, mtime)
+
+    objects_dir = cache.objects_dir if cache else None
+    chunks = ((image_paths[i:i + CHUNK_SIZE], output_folder, sizes, resample_methods, objects_dir) for i in range(0, len(image_paths), CHUNK_SIZE))
+    run_chunks(resize_chunk, chunks, max_workers, store if cache else None)
+
+    if cache:
+        total = cache.save()
+        print(f"{cache.summary()}, {total / 1024 ** 2:.0f} MB cached")
+
+def run_chunks(task, chunks, max_workers, on_result=None):
+    """Runs task(*args) for every args of chunks in a process pool, with at most twice max_workers tasks in flight."""
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for args in chunks:
+            pending.add(executor.submit(task, *args))
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                report(done, on_result)
+        report(pending, on_result)
+
+def report(futures, on_result=None):
+    for future in as_completed(futures):
+        try:
+            result = future.result()  # To catch exceptions if any
+            if on_result:
+                on_result(result)
+        except Exception as exc:
+            print(f"Generated an exception: {exc}")
+
+LETTERBOX_COLOR = (114, 114, 114)  # the gray YOLO pads with
+
+def letterbox_geometry(img_size, size):
+    """Resized (width, height) and (left, top) padding fitting img_size into size without distortion, padding split evenly like YOLO."""
+    scale = min(size[0] / img_size[0], size[1] / img_size[1])
+    new_size = (max(1, round(img_size[0] * scale)), max(1, round(img_size[1] * scale)))
+    return new_size, ((size[0] - new_size[0]) // 2, (size[1] - new_size[1]) // 2)
+
+def read_yolo_labels(label_path):
+    """(class ids, boxes) of a YOLO label file, boxes as rows of normalized center x, center y, width, height."""
+    with open(label_path) as f:
+        values = f.read().split()
+    if len(values) % 5:
+        raise ValueError(f"Label format mismatch in {label_path}: expected 5 elements per line")
+    rows = np.array(values, dtype=np.float64).reshape(-1, 5)
+    return rows[:, 0].astype(np.int64), rows[:, 1:]
+
+def letterbox_boxes(boxes, new_size, pad, size):
+    """Normalized boxes of the original image moved into the letterboxed one."""
+    boxes = boxes.copy()
+    boxes[:, 0] = (boxes[:, 0] * new_size[0] + pad[0]) / size[0]
+    boxes[:, 1] = (boxes[:, 1] * new_size[1] + pad[1]) / size[1]
+    boxes[:, 2] *= new_size[0] / size[0]
+    boxes[:, 3] *= new_size[1] / size[1]
+    return boxes
+
+def letterbox_image(image_path, size, resample):
+    """The image resized into size keeping its aspect ratio and padded, as RGB, with its resized size, padding and format."""
+    with Image.open(image_path) as img:
+        img_format = img.format
+        new_size, pad = letterbox_geometry(img.size, size)
+        draft(img, new_size)
+        canvas = Image.new("RGB", size, LETTERBOX_COLOR)
+        canvas.paste(img.convert("RGB").resize(new_size, resample=resample, reducing_gap=REDUCING_GAP), pad)
+    return canvas, new_size, pad, img_format
+
+def letterbox_chunk(image_paths, label_paths, output_folder, size, resample, shard_path=None):
+    """Letterboxes a chunk of images and rewrites their labels. Written as images/ and labels/ in output_folder,
+    or into one (N, height, width, 3) uint8 shard at shard_path; then returns the shard's image names and label rows (row, class, box)."""
+    names = []
+    label_rows = []
+    shard = None
+    if shard_path:
+        shard = np.lib.format.open_memmap(shard_path, mode="w+", dtype=np.uint8, shape=(len(image_paths), size[1], size[0], 3))
+    for image_path, label_path in zip(image_paths, label_paths):
+        try:
+            canvas, new_size, pad, img_format = letterbox_image(image_path, size, resample)
+            base_name, ext = os.path.splitext(os.path.basename(image_path))
+            labels = None
+            if label_path:
+                class_ids, boxes = read_yolo_labels(label_path)
+                labels = class_ids, letterbox_boxes(boxes, new_size, pad, size)
+
+            if shard is not None:
+                shard[len(names)] = np.asarray(canvas)
+                if labels:
+                    label_rows.extend([len(names), class_id, *box] for class_id, box in zip(labels[0].tolist(), labels[1].tolist()))
+            else:
+                save_resized(canvas, os.path.join(output_folder, "images", base_name + ext), ext, img_format)
+                if labels:
+                    with open(os.path.join(output_folder, "labels", base_name + ".txt"), "w") as f:
+                        f.write("".join(f"{class_id} {cx} {cy} {w} {h}\n" for class_id, (cx, cy, w, h) in zip(labels[0].tolist(), labels[1].tolist())))
+            names.append(base_name + ext)
+            print(f"Letterboxed and saved: {base_name + ext}")
+        except Exception as e:
+            print(f"Failed to process image {image_path}: {e}")
+
+    if shard is not None and len(names) < len(image_paths):  # failed images leave no hole in the shard
+        kept = np.array(shard[:len(names)])
+        del shard
+        np.save(shard_path, kept)
+    return os.path.basename(shard_path) if shard_path else None, names, label_rows
+
+def letterbox_images(input_folder, output_folder, size, resample=Image.BILINEAR, label_folder=None, shard_size=None, max_workers=None):
+    """Resizes the images of input_folder once to the network input size (width, height), aspect ratio kept and padded,
+    and rewrites the matching YOLO labels of label_folder with the same transform.
+    With shard_size, images are stored shard_size at a time in fixed-shape uint8 .npy shards, listed in shards.json,
+    with every label in labels.npy as float32 rows of (shard, row, class, center x, center y, width, height)."""
+    max_workers = max_workers or os.cpu_count() or 1
+    image_paths = load_index(input_folder, recursive=False).paths(('.png', '.jpg', '.jpeg', '.bmp'), recursive=False)
+    labels = load_index(label_folder, recursive=False).labels(recursive=False) if label_folder else {}
+    label_paths = [labels.get(os.path.splitext(os.path.basename(path))[0]) for path in image_paths]
+
+    if shard_size:
+        os.makedirs(output_folder, exist_ok=True)
+    else:
+        os.makedirs(os.path.join(output_folder, "images"), exist_ok=True)
+        os.makedirs(os.path.join(output_folder, "labels"), exist_ok=True)
+    chunk_size = shard_size or CHUNK_SIZE
+    chunks = (
+        (image_paths[i:i + chunk_size], label_paths[i:i + chunk_size], output_folder, size, resample,
+         os.path.join(output_folder, f"shard_{i // chunk_size:05d}.npy") if shard_size else None)
+        for i in range(0, len(image_paths), chunk_size)
+    )
+    shards = []
+    run_chunks(letterbox_chunk, chunks, max_workers, shards.append)
+
+    if shard_size:
+        shards.sort()
+        label_rows = [[shard_number, *row] for shard_number, (_, _, rows) in enumerate(shards) for row in rows]
+        np.save(os.path.join(output_folder, "labels.npy"), np.array(label_rows, dtype=np.float32).reshape(-1, 7))
+        with open(os.path.join(output_folder, "shards.json"), "w") as f:
+            json.dump({"size": list(size), "shards": [{"file": shard_file, "images": names} for shard_file, names, _ in shards]}, f, indent=1)
+    return sum(len(names) for _, names, _ in shards)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resizes or letterboxes the images of a folder, the rest is asked interactively.")
+    parser.add_argument("--no-cache", action="store_true", help="resize every image, do not read or fill the resize cache")
+    parser.add_argument("--cache-dir", default=RESIZE_CACHE_DIR, help=f"resize cache folder (Default: {RESIZE_CACHE_DIR})")
+    args = parser.parse_args()
+
     # Get input interactively and handle trailing whitespace
     input_folder = input("Input folder? ").strip()
-    width_input = input("Width? ").strip()
+    letterbox_input = input("Letterbox to a network input size, labels included? Size like 640 or 640x384 (Default: plain resize) ").strip().lower()
+    if letterbox_input:
+        size = tuple(int(v) for v in letterbox_input.split("x")) * (1 if "x" in letterbox_input else 2)
+        default_labels = os.path.join(os.path.dirname(os.path.normpath(input_folder)), "labels")
+        label_folder = input(f"YOLO labels folder? (Default: {default_labels}, none if missing) ").strip() or default_labels
+        shard_input = input("Images per uint8 .npy shard? (Default: write image files) ").strip()
+        output_folder = f"{input_folder}_letterbox{size[0]}x{size[1]}"
+        count = letterbox_images(input_folder, output_folder, size, Image.BILINEAR, label_folder if os.path.isdir(label_folder) else None, int(shard_input) if shard_input else None)
+        print(f"{count} images have been letterboxed and saved in {output_folder}")
+        exit(0)
+    width_input = input("Width? (comma separated for several sizes) ").strip()
     height_input = input("Height? (Default will infer height to maintain aspect ratio) ").strip()
 
-    # Determine width and height
-    width = int(width_input) if width_input else None
-    height = int(height_input) if height_input else None
+    # Determine width(s) and height(s)
+    widths = [int(w) for w in width_input.split(",") if w.strip()]
+    heights = [int(h) for h in height_input.split(",") if h.strip()] or [None] * len(widths)
 
-    if width is None:
+    if not widths:
         print("Width must be provided.")
         exit(1)
+    if len(heights) != len(widths):
+        print("Give one height per width, or none.")
+        exit(1)
+    sizes = list(zip(widths, heights))
 
     # Ask for resampling method
     resample_map = {
@@ -82,7 +476,7 @@ if __name__ == "__main__":
     output_folder = f"{input_folder}_resized"
 
     # Process images
-    process_images(input_folder, output_folder, width, height, resample_methods)
+    process_images(input_folder, output_folder, widths[0], heights[0], resample_methods, sizes=sizes, cache=None if args.no_cache else ResizeCache(args.cache_dir))
     print(f"All images have been processed and saved in {output_folder}")
     
     """
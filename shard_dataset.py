@@ -0,0 +1,224 @@
+# Packs image/label pairs into size-bounded, uncompressed tar shards, webdataset style: {stem}.jpg is followed by {stem}.txt in the same shard.
+# Each finished shard gets a {shard}.index.json of {stem: {extension: [offset, size]}}, so a reader can mmap the tar and slice any file out by stem.
+# Shards are append-only: every writer claims a new shard number, packing runs in parallel and new data never rewrites old shards.
+# python3 shard_dataset.py pack images_folder labels_folder shards_folder [--workers N] [--shard-size MB]   pairs already packed are skipped
+# python3 shard_dataset.py get shards_folder stem   lists the files stored for stem
+
+import os
+import io
+import re
+import sys
+import json
+import mmap
+import time
+import tarfile
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from rename_mass import get_file_pairs
+
+SHARD_BYTES = 1024 ** 3
+SHARD_PATTERN = re.compile(r"shard-(\d{6})\.tar$")
+
+def shard_path(shard_dir, number):
+    return os.path.join(shard_dir, f"shard-{number:06d}.tar")
+
+def index_path(tar_path):
+    return tar_path[:-len(".tar")] + ".index.json"
+
+def index_shard(tar_path):
+    """{stem: {extension: [offset, size]}} of a shard read from its tar headers. A shard cut short by a crash yields its complete members."""
+    index = {}
+    file_size = os.path.getsize(tar_path)
+    try:
+        with tarfile.open(tar_path, "r:") as tar:
+            for member in tar:
+                if member.isfile() and member.offset_data + member.size <= file_size:
+                    stem, ext = os.path.splitext(member.name)
+                    index.setdefault(stem, {})[ext] = [member.offset_data, member.size]
+    except (tarfile.ReadError, EOFError):
+        pass
+    return index
+
+def write_index(tar_path, index):
+    tmp_path = index_path(tar_path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_path, index_path(tar_path))
+
+class ShardWriter:
+    """Appends samples to new shards of shard_dir, starting another shard once shard_bytes is reached. Thread-safe.
+    Shard numbers are claimed with an exclusive create, several writers (threads, processes, runs) never share a shard."""
+
+    def __init__(self, shard_dir, shard_bytes=SHARD_BYTES):
+        self.shard_dir = shard_dir
+        self.shard_bytes = shard_bytes
+        self.lock = threading.Lock()
+        self.tar = None
+        self.tar_path = None
+        self.shards = []
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def _open(self):
+        numbers = [int(match.group(1)) for match in map(SHARD_PATTERN.match, os.listdir(self.shard_dir)) if match]
+        number = max(numbers, default=-1) + 1
+        while True:
+            try:
+                fd = os.open(shard_path(self.shard_dir, number), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except FileExistsError:
+                number += 1
+        self.tar_path = shard_path(self.shard_dir, number)
+        self.tar = tarfile.open(fileobj=os.fdopen(fd, "wb"), mode="w:", format=tarfile.GNU_FORMAT)
+
+    def add(self, stem, files):
+        """Stores files, {extension: bytes}, under stem. The members of a sample always land in the same shard."""
+        with self.lock:
+            incoming = sum(len(data) for data in files.values())
+            if self.tar is not None and self.tar.offset and self.tar.offset + incoming > self.shard_bytes:
+                self._close_shard()
+            if self.tar is None:
+                self._open()
+            mtime = time.time()
+            for ext, data in files.items():
+                info = tarfile.TarInfo(stem + ext)
+                info.size = len(data)
+                info.mtime = mtime
+                self.tar.addfile(info, io.BytesIO(data))
+            self.tar.fileobj.flush()  # a crash loses at most the sample being written
+
+    def add_paths(self, stem, paths):
+        files = {}
+        for path in paths:
+            with open(path, "rb") as f:
+                files[os.path.splitext(path)[1]] = f.read()
+        self.add(stem, files)
+
+    def _close_shard(self):
+        fileobj = self.tar.fileobj
+        self.tar.close()
+        fileobj.close()
+        write_index(self.tar_path, index_shard(self.tar_path))
+        self.shards.append(self.tar_path)
+        self.tar = None
+
+    def close(self):
+        with self.lock:
+            if self.tar is not None:
+                self._close_shard()
+        return self.shards
+
+class ShardReader:
+    """Random access by stem to the samples of shard_dir through read-only mmaps of the shards.
+    Shards without an index (being written, or cut short by a crash) are indexed from their tar headers, not saved."""
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        self.paths = []
+        self.maps = []
+        self.samples = {}  # stem -> (shard number in self.paths, {extension: [offset, size]})
+        for name in sorted(os.listdir(shard_dir)):
+            if not SHARD_PATTERN.match(name):
+                continue
+            tar_path = os.path.join(shard_dir, name)
+            try:
+                with open(index_path(tar_path)) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = index_shard(tar_path)
+            if not index:
+                continue
+            self.paths.append(tar_path)
+            self.maps.append(None)
+            for stem, members in index.items():
+                self.samples[stem] = (len(self.paths) - 1, members)  # later shards win
+
+    def _map(self, shard):
+        if self.maps[shard] is None:
+            with open(self.paths[shard], "rb") as f:
+                self.maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.maps[shard]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __contains__(self, stem):
+        return stem in self.samples
+
+    def stems(self):
+        return list(self.samples)
+
+    def get(self, stem):
+        """{extension: bytes} of the files of stem, sliced out of the mapped shard. KeyError when missing.
+        Bytes, not views into the map, so samples stay valid after close()."""
+        shard, members = self.samples[stem]
+        shard_map = self._map(shard)
+        return {ext: shard_map[offset:offset + size] for ext, (offset, size) in members.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for shard_map in self.maps:
+            if shard_map is not None:
+                shard_map.close()
+        self.maps = [None] * len(self.paths)
+
+def pack_pairs(pairs, shard_dir, shard_bytes=SHARD_BYTES):
+    """Packs (image path, label path) pairs into new shards, returns the shard paths."""
+    writer = ShardWriter(shard_dir, shard_bytes)
+    for img_file, lbl_file in pairs:
+        writer.add_paths(os.path.splitext(os.path.basename(img_file))[0], [img_file, lbl_file])
+    return writer.close()
+
+def pack_folders(image_folder, label_folder, shard_dir, workers=None, shard_bytes=SHARD_BYTES):
+    """Packs the image/label pairs of two folders, paired like rename_mass does, one writer process per slice of pairs.
+    Pairs whose stem is already in shard_dir are skipped, so packing again only appends the new ones."""
+    paired_files, unpaired_images, unpaired_labels = get_file_pairs(image_folder, label_folder)
+    packed = set(ShardReader(shard_dir).samples) if os.path.isdir(shard_dir) else set()
+    pairs = [pair for pair in paired_files if os.path.splitext(os.path.basename(pair[0]))[0] not in packed]
+    print(f"{len(pairs)} pairs to pack, {len(paired_files) - len(pairs)} already packed, {len(unpaired_images)} images and {len(unpaired_labels)} labels without a pair")
+    if not pairs:
+        return []
+
+    # Contiguous slices keep a shard's samples in listing order, each slice fills its own shards
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pairs)))
+    step = -(-len(pairs) // workers)
+    shards = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(pack_pairs, pairs[i:i + step], shard_dir, shard_bytes) for i in range(0, len(pairs), step)]
+        for future in as_completed(futures):
+            shards.extend(future.result())
+    return sorted(shards)
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs image/label pairs into tar shards with an offset index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="pack the pairs of an images and a labels folder")
+    pack.add_argument("image_folder")
+    pack.add_argument("label_folder")
+    pack.add_argument("shard_dir")
+    pack.add_argument("--workers", type=int, default=None, help="writer processes, default: number of cores")
+    pack.add_argument("--shard-size", type=int, default=SHARD_BYTES // 1024 ** 2, help="shard size in MB, default: 1024")
+    get = commands.add_parser("get", help="list the files stored for a stem")
+    get.add_argument("shard_dir")
+    get.add_argument("stem")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        started = time.perf_counter()
+        shards = pack_folders(args.image_folder, args.label_folder, args.shard_dir, args.workers, args.shard_size * 1024 ** 2)
+        print(f"{len(shards)} new shards in {args.shard_dir}, {time.perf_counter() - started:.2f}s")
+    else:
+        with ShardReader(args.shard_dir) as reader:
+            if args.stem not in reader:
+                print(f"{args.stem} not found in {len(reader)} samples")
+                sys.exit(1)
+            for ext, data in reader.get(args.stem).items():
+                print(f"{args.stem}{ext}: {len(data)} bytes")
+
+if __name__ == "__main__":
+    main()
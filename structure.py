@@ -1,32 +1,145 @@
 #creates a copy of all folders but with just one random file from each.
+# python3 structure.py source_dir dest_dir num_files [--seed N] [--copy] [--workers N]   without arguments, everything is asked interactively
+# Folders are listed in parallel and sampled while being listed, a huge folder is never held in memory. --seed gives the same sample on every run.
+# Files are cloned (reflink) where the filesystem supports it, otherwise hard linked on the same filesystem (--copy forbids links) or copied with copy_file_range.
+# The folders are taken from the cached dataset index, the files are sampled from a live scandir so no listing is held or cached.
 
 import os
-import shutil
+import heapq
 import random
+import shutil
+import hashlib
+import argparse
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataset_index import load_index
+from file_copy import copy_file
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux ioctl, copy-on-write clone on btrfs, xfs, bcachefs...
+BATCH_SIZE = 256
+
+def file_key(seed, name):
+    """Random-looking key of a file name, fixed by the seed."""
+    return int.from_bytes(hashlib.blake2b(os.fsencode(name), key=str(seed).encode()[:64], digest_size=8).digest(), "big")
+
+def sample_folder(folder_path, num_files, seed=None):
+    """num_files file names drawn uniformly from folder_path while it is listed, without keeping the listing.
+    Reservoir sampling with keys: every file gets a random key and the num_files smallest are kept.
+    With a seed, the key is a hash of seed and name, so the sample does not depend on listing order either."""
+    kept = []  # (-key, name), the largest kept key on top
+    if num_files <= 0:
+        return []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            key = random.random() if seed is None else file_key(seed, entry.name)
+            if len(kept) < num_files:
+                heapq.heappush(kept, (-key, entry.name))
+            elif key < -kept[0][0]:
+                heapq.heapreplace(kept, (-key, entry.name))
+    return sorted(name for _, name in kept)
+
+def clone_file(source_file, destination_file):
+    """Copy-on-write clone sharing the source's blocks, OSError where the filesystem cannot."""
+    if fcntl is None:
+        raise OSError("no reflink support on this platform")
+    with open(source_file, 'rb') as fsrc, open(destination_file, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(source_file, destination_file)
 
-def copy_random_files(source_dir, dest_dir, num_files):
-    # List all folders in the source directory
-    folders = [f for f in os.listdir(source_dir) if os.path.isdir(os.path.join(source_dir, f))]
+def place_file(source_file, destination_file, method):
+    """Places source_file at destination_file through a temporary name, the old destination is only replaced once the new one is complete.
+    A destination that already is the source file is left alone, unless it is a hard link from an earlier run and method asks for a real copy."""
+    if os.path.exists(destination_file) and os.path.samefile(source_file, destination_file):
+        if method == "hardlink" or os.path.realpath(source_file) == os.path.realpath(destination_file):
+            return
+    tmp_file = f"{destination_file}.{os.getpid()}.tmp"
+    try:
+        if method == "reflink":
+            clone_file(source_file, tmp_file)
+        elif method == "hardlink":
+            os.link(source_file, tmp_file)
+        else:
+            copy_file(source_file, tmp_file)
+        os.replace(tmp_file, destination_file)  # never writes through an old hard link into the source
+    except BaseException:
+        if os.path.lexists(tmp_file):
+            os.remove(tmp_file)
+        raise
 
-    # Iterate through each folder
-    for folder in folders:
+def pick_method(source_file, destination_file, methods):
+    """Places one file with the first of methods that works and returns it."""
+    for method in methods[:-1]:
+        try:
+            place_file(source_file, destination_file, method)
+            return method
+        except OSError:
+            pass
+    place_file(source_file, destination_file, methods[-1])
+    return methods[-1]
+
+def place_batch(pairs, method):
+    for source_file, destination_file in pairs:
+        place_file(source_file, destination_file, method)
+
+def copy_random_files(source_dir, dest_dir, num_files, seed=None, links=True, max_workers=None):
+    """Recreates the folders of source_dir in dest_dir with num_files random files of each. Returns {method: files}."""
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+    folders = load_index(source_dir, recursive=False).subfolders()
+
+    # Sample every folder in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        samples = list(executor.map(lambda folder: sample_folder(os.path.join(source_dir, folder), num_files, seed), folders))
+
+    # Group the copies by (source, destination) filesystem, the method is found once per group
+    groups = defaultdict(list)
+    os.makedirs(dest_dir, exist_ok=True)
+    dest_device = os.stat(dest_dir).st_dev
+    for folder, selected_files in zip(folders, samples):
+        if not selected_files:
+            continue
         folder_path = os.path.join(source_dir, folder)
-        files = os.listdir(folder_path)
+        dest_folder_path = os.path.join(dest_dir, folder)
+        os.makedirs(dest_folder_path, exist_ok=True)
+        pairs = [(os.path.join(folder_path, name), os.path.join(dest_folder_path, name)) for name in selected_files]
+        groups[os.stat(folder_path).st_dev == dest_device].extend(pairs)
+
+    counts = Counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for same_device, pairs in groups.items():
+            methods = ("reflink", "hardlink", "copy") if same_device and links else ("reflink", "copy") if same_device else ("copy",)
+            method = pick_method(*pairs[0], methods)
+            counts[method] += len(pairs)
+            for i in range(1, len(pairs), BATCH_SIZE):
+                futures.append(executor.submit(place_batch, pairs[i:i + BATCH_SIZE], method))
+        for future in futures:
+            future.result()
+    return dict(counts)
 
-        # If the folder is not empty, select a random file and copy it to the destination folder
-        if files:
-            selected_files = random.sample(files, min(num_files, len(files)))
-            dest_folder_path = os.path.join(dest_dir, folder)
-            os.makedirs(dest_folder_path, exist_ok=True)
-            for selected_file in selected_files:
-                source_file_path = os.path.join(folder_path, selected_file)
-                shutil.copy(source_file_path, dest_folder_path)
+def main():
+    parser = argparse.ArgumentParser(description="Recreates a folder structure with a few random files of each folder.")
+    parser.add_argument("source_dir", nargs="?")
+    parser.add_argument("dest_dir", nargs="?")
+    parser.add_argument("num_files", nargs="?", type=int)
+    parser.add_argument("--seed", default=None, help="same seed, same files")
+    parser.add_argument("--copy", action="store_true", help="real copies (or reflinks), no hard links to the source files")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
 
-# Prompt for the source and destination directories and number of files
-source_dir = input("Enter the path of the source directory: ").strip(' "\'')
-dest_dir = input("Enter the path of the destination directory: ").strip(' "\'')
-num_files = int(input("Enter the number of random files to copy from each folder: "))
+    # Prompt for the source and destination directories and number of files
+    source_dir = args.source_dir or input("Enter the path of the source directory: ").strip(' "\'')
+    dest_dir = args.dest_dir or input("Enter the path of the destination directory: ").strip(' "\'')
+    num_files = args.num_files if args.num_files is not None else int(input("Enter the number of random files to copy from each folder: "))
 
-# Copy a random file from each folder in the source directory to the destination directory
-copy_random_files(source_dir, dest_dir, num_files)
+    # Copy random files from each folder in the source directory to the destination directory
+    counts = copy_random_files(source_dir, dest_dir, num_files, args.seed, not args.copy, args.workers)
+    print(", ".join(f"{count} files by {method}" for method, count in counts.items()) or "No files found")
 
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,272 @@
-#Takes a video file and crops it by removing specified amounts of pixels from its sides (top, right, bottom, left)
-#For exemple, to remove 100 pixels from the top of the video and 20 from bottom: python3 script.py video.mp4 100 0 20 0 
+#Takes a video file or a folder of videos and crops it by removing specified amounts of pixels from its sides (top, bottom, left, right)
+#For exemple, to remove 100 pixels from the top of the video and 20 from bottom: python3 script.py video.mp4 100 20 0 0 
+#One single encode, no temporary file: ffmpeg's crop filter does the whole job when ffmpeg is installed.
  
 import cv2
+import numpy as np
 import os
-import sys
+import time
+import queue
+import shutil
+import argparse
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-def crop_video(file_path, top, bottom, left, right):
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+def crop_with_filter(file_path, final_output_path, top, left, new_width, new_height):
+    """Decode, crop and encode in a single ffmpeg process, audio is copied."""
+    ffmpeg_command = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', file_path,
+        '-vf', f'crop={new_width}:{new_height}:{left}:{top}',
+        '-c:v', 'libx264', '-b:v', '5M', '-c:a', 'copy', final_output_path
+    ]
+    return subprocess.run(ffmpeg_command).returncode == 0
+
+def pipe_encoder_command(file_path, final_output_path, new_width, new_height, fps):
+    """ffmpeg command encoding raw BGR frames read from stdin, with the audio of the source file."""
+    return [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{new_width}x{new_height}', '-r', str(fps), '-i', '-',
+        '-i', file_path, '-map', '0:v', '-map', '1:a?',
+        '-c:v', 'libx264', '-b:v', '5M', '-pix_fmt', 'yuv420p', '-c:a', 'copy', '-shortest', final_output_path
+    ]
+
+def crop_with_pipe(cap, file_path, final_output_path, top, left, new_width, new_height, fps):
+    """Crop with OpenCV and pipe the raw frames into one ffmpeg encoder over stdin, audio is taken from the source."""
+    encoder = subprocess.Popen(pipe_encoder_command(file_path, final_output_path, new_width, new_height, fps), stdin=subprocess.PIPE)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            # Slicing is a view, tobytes() is the only copy before the pipe
+            encoder.stdin.write(frame[top:top+new_height, left:left+new_width].tobytes())
+    except BrokenPipeError:
+        pass  # ffmpeg exited, its return code tells why
+    finally:
+        encoder.stdin.close()
+    return encoder.wait() == 0
+
+def open_writer(final_output_path, fps, size):
+    """OpenCV writer for the output, H264 when this OpenCV build has it, MPEG-4 otherwise (the pip wheels have no H264). None when neither opens."""
+    for codec in ('avc1', 'mp4v'):
+        out = cv2.VideoWriter(final_output_path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if out.isOpened():
+            return out
+        out.release()
+    return None
+
+def crop_with_opencv(cap, final_output_path, top, left, new_width, new_height, fps):
+    """No ffmpeg available: encode once with OpenCV's writer. OpenCV does not carry audio over. False when no writer can be opened."""
+    out = open_writer(final_output_path, fps, (new_width, new_height))
+    if out is None:
+        return False
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        out.write(frame[top:top+new_height, left:left+new_width])
+    out.release()
+    return True
+
+def crop_video(file_path, top, bottom, left, right, mode="auto"):
+    """Crop one video with a single encode. mode is filter (ffmpeg only), pipe (OpenCV decode, ffmpeg encode), opencv, or auto."""
     cap = cv2.VideoCapture(file_path)
     
     if not cap.isOpened():
         print(f"Error opening video file: {file_path}")
-        return
+        return None
 
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
     new_width = frame_width - left - right
     new_height = frame_height - top - bottom
 
     if new_width <= 0 or new_height <= 0:
+        cap.release()
         print("Cropping dimensions are too large, resulting in non-positive frame dimensions.")
-        return
+        return None
 
-    # Define the codec and create VideoWriter object
-    output_path = os.path.splitext(file_path)[0] + "_cropped_temp.mp4"
-    fourcc = cv2.VideoWriter_fourcc(*'avc1')  # H264 codec
-    out = cv2.VideoWriter(output_path, fourcc, fps, (new_width, new_height))
+    final_output_path = os.path.splitext(file_path)[0] + "_cropped.mp4"
+    if mode == "auto":
+        mode = "filter" if shutil.which("ffmpeg") else "opencv"
+    if mode == "opencv":
+        print(f"ffmpeg not found, {file_path} is encoded by OpenCV without audio")
 
-    for _ in range(total_frames):
-        ret, frame = cap.read()
-        if not ret:
-            break
+    if mode == "filter":
+        cap.release()
+        ok = crop_with_filter(file_path, final_output_path, top, left, new_width, new_height)
+    elif mode == "pipe":
+        ok = crop_with_pipe(cap, file_path, final_output_path, top, left, new_width, new_height, fps)
+    else:
+        ok = crop_with_opencv(cap, final_output_path, top, left, new_width, new_height, fps)
+    cap.release()
 
-        # Crop the frame
-        cropped_frame = frame[top:top+new_height, left:left+new_width]
-        
-        # Write the cropped frame
-        out.write(cropped_frame)
+    if not ok:
+        print(f"Error cropping {file_path}")
+        return None
+    print(f"Final cropped video saved as {final_output_path}")
+    return final_output_path
 
-    # Release everything if job is finished
-    cap.release()
-    out.release()
-    print(f"Temporary cropped video saved as {output_path}")
+def crop_video_pipelined(file_path, top, bottom, left, right, buffers=8):
+    """Reader, cropper and writer run as separate stages connected by bounded queues.
+    Frames are decoded into a fixed pool of preallocated buffers and cropped as views, nothing is allocated per frame.
+    Encodes with ffmpeg over stdin (audio kept) when available, else with OpenCV.
+    Returns frames/s of each stage measured on the time it was busy, the slowest stage is the bottleneck."""
+    cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        print(f"Error opening video file: {file_path}")
+        return None
+
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    new_width = frame_width - left - right
+    new_height = frame_height - top - bottom
+    if new_width <= 0 or new_height <= 0:
+        cap.release()
+        print("Cropping dimensions are too large, resulting in non-positive frame dimensions.")
+        return None
 
-    # Re-encode the video with a higher bitrate using ffmpeg
     final_output_path = os.path.splitext(file_path)[0] + "_cropped.mp4"
-    ffmpeg_command = [
-        'ffmpeg', '-i', output_path, '-c:v', 'libx264', '-b:v', '5M', '-c:a', 'copy', final_output_path
-    ]
-    subprocess.run(ffmpeg_command)
+    free_frames = queue.Queue()
+    for _ in range(buffers):
+        free_frames.put(np.empty((frame_height, frame_width, 3), np.uint8))
 
-    # Remove the temporary file
-    os.remove(output_path)
-    print(f"Final cropped video saved as {final_output_path}")
+    if shutil.which("ffmpeg"):
+        encoder = subprocess.Popen(pipe_encoder_command(file_path, final_output_path, new_width, new_height, fps), stdin=subprocess.PIPE)
+        write = encoder.stdin.write
+        # The pipe needs contiguous bytes, crops are packed into their own preallocated buffers
+        free_crops = queue.Queue()
+        for _ in range(buffers):
+            free_crops.put(np.empty((new_height, new_width, 3), np.uint8))
+    else:
+        encoder = None
+        out = open_writer(final_output_path, fps, (new_width, new_height))
+        if out is None:
+            cap.release()
+            print(f"Error cropping {file_path}: no OpenCV video writer could be opened")
+            return None
+        write = out.write  # takes the view as is
+        free_crops = None
 
-def main():
-    if len(sys.argv) != 6:
-        print("Usage: python script.py <file_path> <top> <bottom> <left> <right>")
-        return
+    to_crop = queue.Queue(maxsize=buffers)
+    to_write = queue.Queue(maxsize=buffers)
+    busy = {"read": 0.0, "crop": 0.0, "write": 0.0}
+    frames = 0
 
-    file_path = sys.argv[1]
-    top = int(sys.argv[2])
-    bottom = int(sys.argv[3])
-    left = int(sys.argv[4])
-    right = int(sys.argv[5])
+    def reader():
+        nonlocal frames
+        while True:
+            buffer = free_frames.get()
+            started = time.perf_counter()
+            ret, frame = cap.read(buffer)  # decodes in place when the buffer fits
+            busy["read"] += time.perf_counter() - started
+            if not ret:
+                break
+            frames += 1
+            to_crop.put(frame)
+        to_crop.put(None)
+
+    def cropper():
+        while True:
+            frame = to_crop.get()
+            if frame is None:
+                break
+            crop_buffer = free_crops.get() if free_crops is not None else None
+            started = time.perf_counter()
+            view = frame[top:top+new_height, left:left+new_width]
+            if crop_buffer is not None:
+                np.copyto(crop_buffer, view)
+                free_frames.put(frame)
+                item = (None, crop_buffer)
+            else:
+                item = (frame, view)
+            busy["crop"] += time.perf_counter() - started
+            to_write.put(item)
+        to_write.put(None)
+
+    threads = [threading.Thread(target=reader), threading.Thread(target=cropper)]
+    for t in threads:
+        t.start()
+
+    failed = False
+    while True:
+        item = to_write.get()
+        if item is None:
+            break
+        frame, crop = item
+        started = time.perf_counter()
+        if not failed:
+            try:
+                write(crop)
+            except BrokenPipeError:
+                failed = True  # keep draining so the other stages can finish
+        busy["write"] += time.perf_counter() - started
+        if frame is not None:
+            free_frames.put(frame)
+        else:
+            free_crops.put(crop)
+
+    for t in threads:
+        t.join()
+    cap.release()
+    if encoder:
+        encoder.stdin.close()
+        failed = encoder.wait() != 0 or failed
+    else:
+        out.release()
+
+    if failed:
+        print(f"Error cropping {file_path}")
+        return None
+    stage_fps = {stage: frames / seconds if seconds else float("inf") for stage, seconds in busy.items()}
+    bottleneck = min(stage_fps, key=stage_fps.get)
+    print(f"Final cropped video saved as {final_output_path}: {frames} frames, " + ", ".join(f"{stage} {value:.0f} fps" for stage, value in stage_fps.items()) + f" (bottleneck: {bottleneck})")
+    return stage_fps
+
+def crop_folder(folder, top, bottom, left, right, mode="auto", jobs=None, pipeline=False):
+    """Crop every video of a folder, several at once.
+    Threads are enough for the single-call modes, the work happens in ffmpeg or in OpenCV without the GIL. The pipelined mode runs in a process pool."""
+    video_files = [
+        os.path.join(folder, f) for f in sorted(os.listdir(folder))
+        if f.lower().endswith(VIDEO_EXTENSIONS) and not os.path.splitext(f)[0].endswith("_cropped")
+    ]
+    jobs = jobs or max(1, (os.cpu_count() or 2) // 2)  # each ffmpeg uses several threads itself
+    executor_class = ProcessPoolExecutor if pipeline else ThreadPoolExecutor
+    with executor_class(max_workers=jobs) as executor:
+        if pipeline:
+            futures = {executor.submit(crop_video_pipelined, video, top, bottom, left, right): video for video in video_files}
+        else:
+            futures = {executor.submit(crop_video, video, top, bottom, left, right, mode): video for video in video_files}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error cropping {futures[future]}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop a video, or every video of a folder, by removing pixels from its sides.")
+    parser.add_argument("file_path", help="Video file or folder of videos.")
+    parser.add_argument("top", type=int)
+    parser.add_argument("bottom", type=int)
+    parser.add_argument("left", type=int)
+    parser.add_argument("right", type=int)
+    parser.add_argument("--mode", choices=["auto", "filter", "pipe", "opencv"], default="auto", help="filter: ffmpeg crop filter, pipe: OpenCV frames piped to ffmpeg, opencv: no ffmpeg, no audio. Default picks filter when ffmpeg exists.")
+    parser.add_argument("--jobs", type=int, default=None, help="Videos cropped at once for folders. Default is half the cores.")
+    parser.add_argument("--pipeline", action="store_true", help="Separate reader/cropper/writer stages with reused buffers, folders spread over a process pool. Prints frames/s per stage.")
+    args = parser.parse_args()
 
-    crop_video(file_path, top, bottom, left, right)
+    if os.path.isdir(args.file_path):
+        crop_folder(args.file_path, args.top, args.bottom, args.left, args.right, args.mode, args.jobs, args.pipeline)
+    elif args.pipeline:
+        crop_video_pipelined(args.file_path, args.top, args.bottom, args.left, args.right)
+    else:
+        crop_video(args.file_path, args.top, args.bottom, args.left, args.right, args.mode)
 
 if __name__ == "__main__":
     main()
@@ -2,129 +2,195 @@
 # class, x1, y1, x2, y2, x3, y3, x4, y4: image normalized coordinates of the four corners of the oriented bounding box 
 #
 # <class_id> <center_x> <center_y> <width> <height>
-# Backup: label files are backed up to a backup/ folder before any changes are made.
+# Backup: label files are backed up to a single tar archive in backup/ before any changes are made.
 # if image folder is given, checks for missing labels
+#
+# python3 yobb_to_yolo_bbox.py labels_path [--images images_path] [--validate]   (no arguments: interactive)
+# --validate only reports format errors, nothing is written. Also importable: convert_folder(), validate_labels().
 
 
 
 
 import os
+import sys
+import time
 import shutil
+import tarfile
+import argparse
 import concurrent.futures
+import numpy as np
 from tqdm import tqdm
 import traceback
-
-# Interactive input for the dataset directories
-label_folder = input("Label folder (.txt label files): ").strip()
-image_folder = input("Optional image folder (to check for missing labels,  Enter to skip): ").strip()
-
-backup_folder = os.path.join(label_folder, "backup")
-error_folder = os.path.join(label_folder, "errors") if image_folder else None
-
-# 
-if not os.path.exists(backup_folder):
-    os.makedirs(backup_folder)
-if error_folder and not os.path.exists(error_folder):
-    os.makedirs(error_folder)
-
-def make_backup(label_file):
-    backup_path = os.path.join(backup_folder, os.path.basename(label_file))
-    if not os.path.exists(backup_path):
-        shutil.copy(label_file, backup_path)
-
-def convert_oriented_bbox_to_yolo(label_file):
-    """Converts coordinates-oriented bounding box annotations to YOLO format."""
-    try:
-        with open(label_file, 'r') as f:
-            lines = f.readlines()
-
-        # Create a backup
-        make_backup(label_file)
-
-        # Convert the oriented bounding boxes to YOLO format
-        new_lines = []
-        for line in lines:
-            parts = line.strip().split()
-
-            if len(parts) != 9:
-                raise ValueError(f"Label format mismatch in {label_file}: expected 9 elements, got {len(parts)}")
-
-            # Extract the class_id and coordinates of the four corners
-            class_id = parts[0]
-            x1, y1, x2, y2, x3, y3, x4, y4 = map(float, parts[1:])
-
-            # Math to get the center of the bounding box
-            center_x = (x1 + x2 + x3 + x4) / 4.0
-            center_y = (y1 + y2 + y3 + y4) / 4.0
-
-            # Math to get the width and height of the bounding box (axis-aligned)
-            width = max(x1, x2, x3, x4) - min(x1, x2, x3, x4)
-            height = max(y1, y2, y3, y4) - min(y1, y2, y3, y4)
-
-            # Construct the new YOLO bounding box line
-            new_line = f"{class_id} {center_x} {center_y} {width} {height}\n"
-            new_lines.append(new_line)
-
-            # overwrites -backup was made
-        with open(label_file, 'w') as f:
-            f.writelines(new_lines)
-
-    except Exception as e:
-        # If an error occurs, move the file to the error folder
-        print(f"Bug processing {label_file}: {str(e)}")
-        if error_folder:
-            shutil.move(label_file, os.path.join(error_folder, os.path.basename(label_file)))
-        return False
-    return True
-
-def process_file_pair(label_file):
-    """Process each label file, check for paired image if the image folder is provided."""
-    try:
-        # Get the corresponding image file if an image folder is provided
-        image_file = None
-        if image_folder:
-            image_filename = os.path.splitext(os.path.basename(label_file))[0] + ".jpg"
-            image_file = os.path.join(image_folder, image_filename)
-
-            if not os.path.exists(image_file):
-                raise FileNotFoundError(f"Image file not found: {image_file}")
-
-        # Convert the oriented bounding box to YOLO format
-        success = convert_oriented_bbox_to_yolo(label_file)
-
-        if success and image_file:
-            return (label_file, image_file)  
-
-    except Exception as e:
-        print(f"Bug processing pair {label_file}: {str(e)}")
-        if error_folder:
-            shutil.move(label_file, os.path.join(error_folder, os.path.basename(label_file)))
-            if image_file and os.path.exists(image_file):
-                shutil.move(image_file, os.path.join(error_folder, os.path.basename(image_file)))
-        return None
-
-def main():
-    # Gather label files from the label folder
-    label_files = [os.path.join(label_folder, f) for f in os.listdir(label_folder) if f.endswith('.txt')]
-
-    # Progress bar for tracking processing
+from dataset_index import load_index
+
+CHUNK_SIZE = 512  # label files per batch sent to a worker process
+
+def convert_label_files(label_files, error_dir=None):
+    """Batch engine: parses many label files into one (N, 8) float array and computes every center and extent in a single vectorized pass.
+    Each box becomes its center and axis-aligned extent, files with errors are reported and moved to error_dir. Returns the number converted.
+    Files must already be backed up, see backup_labels."""
+    parsed = []  # (label_file, class ids) in the order their boxes were appended
+    values = []
+    for label_file in label_files:
+        try:
+            with open(label_file, 'r') as f:
+                lines = f.readlines()
+
+            class_ids = []
+            coordinates = []
+            for line in lines:
+                parts = line.strip().split()
+                if len(parts) != 9:
+                    raise ValueError(f"Label format mismatch in {label_file}: expected 9 elements, got {len(parts)}")
+                class_ids.append(parts[0])
+                coordinates.extend(parts[1:])
+            coordinates = list(map(float, coordinates))
+        except Exception as e:
+            print(f"Bug processing {label_file}: {str(e)}")
+            if error_dir:
+                shutil.move(label_file, os.path.join(error_dir, os.path.basename(label_file)))
+            continue
+        parsed.append((label_file, class_ids))
+        values.extend(coordinates)
+
+    boxes = np.array(values, dtype=np.float64).reshape(-1, 8)
+    xs = boxes[:, 0::2]
+    ys = boxes[:, 1::2]
+    # Summed corner by corner, left to right, so the floats round like the original per-box code
+    center_x = (xs[:, 0] + xs[:, 1] + xs[:, 2] + xs[:, 3]) / 4.0
+    center_y = (ys[:, 0] + ys[:, 1] + ys[:, 2] + ys[:, 3]) / 4.0
+    width = xs.max(axis=1) - xs.min(axis=1)
+    height = ys.max(axis=1) - ys.min(axis=1)
+    rows = np.stack([center_x, center_y, width, height], axis=1).tolist()  # python floats, formatted with repr like the original output
+
+    converted = 0
+    offset = 0
+    for label_file, class_ids in parsed:
+        file_rows = rows[offset:offset + len(class_ids)]
+        offset += len(class_ids)
+        try:
+            with open(label_file, 'w') as f:
+                f.write("".join(f"{class_id} {cx} {cy} {w} {h}\n" for class_id, (cx, cy, w, h) in zip(class_ids, file_rows)))
+            converted += 1
+        except Exception as e:
+            print(f"Bug processing {label_file}: {str(e)}")
+            if error_dir:
+                shutil.move(label_file, os.path.join(error_dir, os.path.basename(label_file)))
+    return converted
+
+def image_names(image_dir, persist=True):
+    """Names of the .jpg files of the image folder, from the cached dataset index. Without persist, the index cache is read but not written."""
+    return {os.path.basename(path) for path in load_index(image_dir, persist, recursive=False).paths(('.jpg',), recursive=False)}
+
+def check_image_pairs(label_files, image_dir, error_dir=None):
+    """Keeps the label files that have their .jpg in the image folder, moves the others to the error folder."""
+    images = image_names(image_dir)
+    paired = []
+    for label_file in label_files:
+        image_file = os.path.join(image_dir, os.path.splitext(os.path.basename(label_file))[0] + ".jpg")
+        if os.path.basename(image_file) in images:
+            paired.append(label_file)
+            continue
+        print(f"Bug processing pair {label_file}: Image file not found: {image_file}")
+        if error_dir:
+            shutil.move(label_file, os.path.join(error_dir, os.path.basename(label_file)))
+    return paired
+
+def list_label_files(label_dir, persist=True):
+    return load_index(label_dir, persist, recursive=False).paths(('.txt',), recursive=False)
+
+def iter_label_errors(label_files, image_dir=None):
+    """Streams over the label files and yields (label_file, error) for each problem found. Reads only, nothing is written."""
+    images = image_names(image_dir, persist=False) if image_dir else None
+    for label_file in label_files:
+        if image_dir:
+            image_file = os.path.join(image_dir, os.path.splitext(os.path.basename(label_file))[0] + ".jpg")
+            if os.path.basename(image_file) not in images:
+                yield label_file, f"Image file not found: {image_file}"
+        try:
+            with open(label_file, 'r') as f:
+                for line_number, line in enumerate(f, 1):
+                    parts = line.split()
+                    if len(parts) != 9:
+                        yield label_file, f"line {line_number}: expected 9 elements, got {len(parts)}"
+                        continue
+                    try:
+                        list(map(float, parts[1:]))
+                    except ValueError as e:
+                        yield label_file, f"line {line_number}: {e}"
+        except (OSError, UnicodeDecodeError) as e:
+            yield label_file, str(e)
+
+def validate_labels(label_dir, image_dir=None):
+    """Validate-only mode: prints every format error and returns (files checked, files with errors). Nothing is written, not even the index cache."""
+    label_files = list_label_files(label_dir, persist=False)
+    bad_files = set()
+    for label_file, error in iter_label_errors(tqdm(label_files, desc="Validating Labels"), image_dir):
+        bad_files.add(label_file)
+        print(f"{label_file}: {error}")
+    print(f"{len(label_files) - len(bad_files)} of {len(label_files)} label files are valid")
+    return len(label_files), len(bad_files)
+
+def backup_labels(label_files, backup_dir):
+    """Backs up all label files into one uncompressed tar archive, written as a single sequential stream. Returns the archive path."""
+    os.makedirs(backup_dir, exist_ok=True)
+    archive_path = os.path.join(backup_dir, f"labels_{time.strftime('%Y%m%d_%H%M%S')}.tar")
+    with tarfile.open(archive_path, "w") as archive:
+        for label_file in label_files:
+            archive.add(label_file, arcname=os.path.basename(label_file))
+    return archive_path
+
+def convert_folder(label_dir, image_dir=None, validate_only=False):
+    """Converts every label file of label_dir to YOLO bbox format. Returns (label files, files that failed).
+    With validate_only, only reports format errors (see validate_labels), failed then counts the files with errors."""
+    if validate_only:
+        return validate_labels(label_dir, image_dir)
+
+    error_dir = os.path.join(label_dir, "errors") if image_dir else None
+    if error_dir:
+        os.makedirs(error_dir, exist_ok=True)
+
+    label_files = list_label_files(label_dir)
+    total = len(label_files)
+    archive_path = backup_labels(label_files, os.path.join(label_dir, "backup"))
+    print(f"Backup: {archive_path}")
+    if image_dir:
+        label_files = check_image_pairs(label_files, image_dir, error_dir)
+
+    # Chunks of files go to a process pool, each chunk is converted in one vectorized pass
+    chunks = [label_files[i:i + CHUNK_SIZE] for i in range(0, len(label_files), CHUNK_SIZE)]
+    converted = 0
     with tqdm(total=len(label_files), desc="Processing Labels") as pbar:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Process files concurrently
-            futures = [executor.submit(process_file_pair, label_file) for label_file in label_files]
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            futures = {executor.submit(convert_label_files, chunk, error_dir): chunk for chunk in chunks}
 
             for future in concurrent.futures.as_completed(futures):
-                # Update progress bar for each completed file
                 try:
-                    result = future.result()
-                    if result:
-                        # Log successful processing
-                        label_file, image_file = result
-                        print(f"Successfully processed {label_file}")
+                    converted += future.result()
                 except Exception as e:
                     print(f"Bug: {traceback.format_exc()}")
                 finally:
-                    pbar.update(1)
+                    pbar.update(len(futures[future]))
+    print(f"Successfully processed {converted} of {len(label_files)} label files")
+    return total, total - converted
+
+def main():
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Convert oriented bbox labels to YOLO bbox labels.")
+        parser.add_argument("label_folder", help="Folder of .txt label files.")
+        parser.add_argument("--images", default=None, help="Image folder, to check for missing images.")
+        parser.add_argument("--validate", action="store_true", help="Only report format errors, write nothing.")
+        args = parser.parse_args()
+        label_dir, image_dir, validate_only = args.label_folder, args.images, args.validate
+    else:
+        # Interactive input for the dataset directories
+        label_dir = input("Label folder (.txt label files): ").strip()
+        image_dir = input("Optional image folder (to check for missing labels,  Enter to skip): ").strip() or None
+        validate_only = input("Validate only, without writing? (y/N): ").strip().lower() == "y"
+
+    _, failed = convert_folder(label_dir, image_dir, validate_only)
+    if validate_only and failed:
+        sys.exit(1)  # lets CI fail on bad labels
 
 if __name__ == "__main__":
     try: